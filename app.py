@@ -0,0 +1,452 @@
+"""
+Module with the tasks web application as a WSGI callable.
+
+All routing and rendering happens here; the servers in server.py and
+aserver.py only translate between HTTP and WSGI. The application can also
+be run by any WSGI server, e.g.
+
+    gunicorn --workers 4 --threads 8 app:application
+
+or be called directly, without sockets, in tests and benchmarks.
+"""
+
+from http import HTTPStatus
+from urllib.parse import parse_qs
+
+import pprint
+
+import catalog
+import config
+import db
+import qrcache
+import singleflight
+import tasks
+import templating
+
+# these modules only read from the database
+READ_ONLY_MODULES = ("debug", "voucher", "list")
+
+HTML = "text/html; charset=utf-8"
+TEXT = "text/plain; charset=utf-8"
+PNG = "image/png"
+
+QRCODE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# identical expensive renders running at the same time are done only once
+flight = singleflight.SingleFlight()
+
+# the pages need these templates, the server does not start without them
+TEMPLATES = (
+    "task_debug.tpl",
+    "task_done.tpl",
+    "task_list.tpl",
+    "task_not_found.tpl",
+    "task_not_found_pending.tpl",
+    "task_show.tpl",
+    "task_show_done.tpl",
+    "task_show_no_vetoes.tpl",
+    "task_show_pending.tpl",
+    "task_show_vetoed.tpl",
+    "task_veto.tpl",
+    "task_veto_fail.tpl",
+    "task_vouchers.tpl",
+    "tasks_help.tpl",
+)
+
+
+class Request:
+    """
+    The parts of the WSGI environ a page needs, and the unit of work the
+    request runs in.
+    """
+
+    def __init__(self, environ):
+        self.environ = environ
+        self.path = environ.get("PATH_INFO", "")
+        self.query_string = environ.get("QUERY_STRING", "")
+        self.query_params = parse_qs(self.query_string)
+        # we use the host the client asked for in links to ourselves
+        self.host = environ.get("HTTP_HOST", "")
+        self.protocol = environ.get("SERVER_PROTOCOL", "HTTP/1.0")
+        self.scheme = environ.get("wsgi.url_scheme", "http")
+        self.server = (
+            f"{environ.get('SERVER_NAME', '')}:{environ.get('SERVER_PORT', '')}"
+        )
+        self.uow = None
+
+    def matches_etag(self, etag):
+        """
+        Tell whether the client already has the version with the given ETag.
+        """
+        if_none_match = self.environ.get("HTTP_IF_NONE_MATCH")
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # If-None-Match uses the weak comparison
+        return "*" in tags or etag in [tag.removeprefix("W/") for tag in tags]
+
+    @property
+    def full_path(self):
+        if self.query_string:
+            return f"{self.path}?{self.query_string}"
+        return self.path
+
+
+class Response:
+    """
+    Status, headers and body of an answer. The body is rendered completely
+    before it is sent, so its length is always known.
+    """
+
+    def __init__(self, status=200, body=b"", content_type=HTML, headers=None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or []
+
+    @property
+    def status_line(self):
+        return f"{self.status} {HTTPStatus(self.status).phrase}"
+
+    def wsgi_headers(self):
+        if self.status == 304:
+            # a 304 has no body, and must not announce one of its own
+            return self.headers
+        return [
+            ("Content-Type", self.content_type),
+            ("Content-Length", str(len(self.body))),
+        ] + self.headers
+
+
+def show_page(request, task, template):
+    """
+    create the page to show for an action on a task
+    """
+    # we fill a copy, the task itself stays as it came from the catalog
+    page = dict(task)
+    # the when and description fields are markdown, a list has one line per entry
+    for field in ("when", "description"):
+        if field in page:
+            page[field] = templating.render_markdown(page[field])
+    if "id" not in page:
+        # a page about no task at all, e.g. task_not_found.tpl, shows no status
+        return templating.render(template, page)
+    page["remaining_vetoes"] = tasks.get_remaining_vetoes(task["user"], uow=request.uow)
+    page["used_vetoes"] = config.read_config()["vetoes"] - page["remaining_vetoes"]
+    if page["remaining_vetoes"] == 0:
+        page["remaining_vetoes"] = "keinen"
+    if page["used_vetoes"] == 0:
+        page["used_vetoes"] = "keinen"
+    # we get the task status to display it
+    page["status"] = tasks.get_task_status(task, uow=request.uow)
+    return templating.render(template, page)
+
+
+def veto_task(request, user, id, task):
+    """
+    Prepare data and display web page for vetoing a task.
+    """
+    # depending on success or failure, we show a different page
+    if not tasks.veto_task(user, id, uow=request.uow):
+        return Response(body=show_page(request, task, "task_veto_fail.tpl"))
+    return Response(body=show_page(request, task, "task_veto.tpl"))
+
+
+def do_task(request, user, id, task):
+    """
+    Prepare data and display web page for doing a task.
+    """
+    tasks.do_task(user=user, id=id, uow=request.uow)
+    return Response(body=show_page(request, task, "task_done.tpl"))
+
+
+def show_task(request, user, id, task):
+    """
+    Prepare data and display web page for showing a task.
+    """
+    result = tasks.show_task(user=user, id=id, uow=request.uow)
+    if result["id"] != task["id"]:
+        result["user"] = user
+        result["token"] = task["token"]
+        template = "task_show_pending.tpl"
+        task = result
+    else:
+        task_status = tasks.get_task_status(task, uow=request.uow)
+        if task_status == "Abgelehnt":
+            template = "task_show_vetoed.tpl"
+        elif task_status == "Erledigt":
+            template = "task_show_done.tpl"
+        elif tasks.get_remaining_vetoes(user, uow=request.uow) == 0:
+            template = "task_show_no_vetoes.tpl"
+        else:
+            template = "task_show.tpl"
+    return Response(body=show_page(request, task, template))
+
+
+def show_help(request, user, id, task):
+    """
+    Show the help text in the template tasks_help.tpl
+    """
+    tasks.store_help(user=user, task=task, uow=request.uow)
+    return Response(body=show_page(request, task, "tasks_help.tpl"))
+
+
+def list_vouchers(request, user, token, task_list, inline=False):
+    """
+    Get the list of vouchers for a user. With inline=True the QR codes are
+    embedded into the page instead of being fetched one by one.
+    """
+    content = {}
+    protocol = "http://"
+    url = request.host
+    images = {}
+    if inline:
+        links = []
+        for idx in range(len(task_list)):
+            links.append(protocol + url + f"/tasks/show?id={idx}&token={token}")
+            links.append(protocol + url + f"/tasks/help?id={idx}&token={token}")
+        # all codes of the sheet at once, each distinct link only once
+        images = {
+            link: qrcache.data_uri(png)
+            for link, (png, _) in qrcache.get_pngs(links).items()
+        }
+    table_content = """"
+    <table>
+    <tr>
+        <th>Title</th>
+        <th>QR-Code</th>
+        <th>Link</th>
+    </tr>
+    """
+    for idx, task in enumerate(task_list):
+        title = task["title"]
+        task_url = protocol + url + f"/tasks/show?id={idx}&token={token}"
+        img_url = protocol + url + f"/tasks/qrcode?token={token}&url={task_url}"
+        help_url = protocol + url + f"/tasks/help?id={idx}&token={token}"
+        help_img_url = protocol + url + f"/tasks/qrcode?token={token}&url={help_url}"
+        if inline:
+            img_url = images[task_url]
+            help_img_url = images[help_url]
+        table_row = """<tr>
+            <td>Aufgabe: {title}</td>
+            <td>Scan mich!</td>
+            <td><a href="{task_url}"><img src="{img_url}" alt="QR Code" height="50" width="50"/></a></td>
+            <td>Scan hier für die Erklärung des Spiels</td>
+            <td><a href="{help_url}"><img src="{help_img_url}" alt="QR Code" height="50" width="50"/></a></td>
+        </tr>
+        """
+        table_content += table_row.format(
+            title=title,
+            task_url=task_url,
+            img_url=img_url,
+            help_img_url=help_img_url,
+            help_url=help_url,
+        )
+
+    table_content += """
+    </table>
+    """
+    content["table_content"] = table_content
+    content["user"] = user
+    content["token"] = token
+    body = templating.render("task_vouchers.tpl", content)
+    return Response(body=body)
+
+
+def show_debug(request, cfg):
+    all_task_list = tasks.list_all_tasks(uow=request.uow)
+    content = {
+        "protocol": request.protocol,
+        "url": f"{request.scheme}://{request.host}",
+        "server": request.server,
+        "request_path": request.full_path,
+        "request_data": "<pre>" + pprint.pformat(request.query_params) + "</pre>",
+        "task_data": "<pre>" + pprint.pformat(all_task_list) + "</pre>",
+        "config_data": "<pre>" + pprint.pformat(config.thaw(cfg)) + "</pre>",
+    }
+    body = templating.render("task_debug.tpl", content)
+    return Response(body=body)
+
+
+def show_qrcode(request, token):
+    qr_url = request.query_params.get("url", [""])[0]
+    if not qr_url:
+        return Response(400, b"URL parameter required", TEXT)
+    qr_url += f"&token={token}"
+    # the image of a link never changes; it contains a token, so only the browser may keep it
+    etag = qrcache.make_etag(qr_url)
+    headers = [("ETag", etag), ("Cache-Control", QRCODE_CACHE_CONTROL)]
+    if request.matches_etag(etag):
+        return Response(304, headers=headers)
+    # the same voucher sheet opened on several devices asks for the same codes at once
+    png, _ = flight.do(("qrcode", qr_url), lambda: qrcache.get_png(qr_url))
+    return Response(body=png, content_type=PNG, headers=headers)
+
+
+def list_task_table(request, task_list):
+    content = {}
+    # starting the table
+    tablecontent = """
+    <table>
+    <tr>
+        <th>ID</th>
+        <th>Description</th>
+        <th>When</th>
+        <th>Shown</th>
+        <th>Done</th>
+        <th>Vetoed</th>
+    </tr>
+    """
+    for task in task_list:
+        if isinstance(task["when"], list):
+            task["when"] = "\n".join(task["when"])
+        if isinstance(task["description"], list):
+            task["description"] = "\n".join(task["description"])
+        tablecontent += f"""
+        <tr>
+            <td>{task["id"]}</td>
+            <td>{task["description"]}</td>
+            <td>{task["when"]}</td>
+            <td>{task.get("shown_at", "N/A")}</td>
+            <td>{task.get("done_at", "N/A")}</td>
+            <td>{task.get("vetoed_at", "N/A")}</td>
+        </tr>
+        """
+    # finalize the table
+    tablecontent += """
+    </table>
+    """
+    content["task_table"] = tablecontent
+    body = templating.render("task_list.tpl", content)
+    return Response(body=body)
+
+
+def handle(request):
+    """
+    Route the request to the page of its module.
+    """
+    path_parts = request.path.strip("/").split("/")
+
+    if not path_parts or not path_parts[0]:
+        return Response(400, b"Module name required", TEXT)
+
+    module_name = path_parts[path_parts.index("tasks") + 1]
+
+    if "token" not in request.query_params:
+        return Response(403, b"Token required", TEXT)
+    token = request.query_params["token"][0]
+    cfg = config.read_config()
+    user = config.get_user_from_token(cfg, token)
+    if not user:
+        return Response(403, b"Invalid token", TEXT)
+    if module_name == "qrcode":
+        # a QR code only encodes the link, it needs neither the tasks nor the database
+        return show_qrcode(request, token)
+
+    # everything the request reads and writes happens in one transaction
+    with db.UnitOfWork(
+        tasks.DB_NAME, write=module_name not in READ_ONLY_MODULES
+    ) as uow:
+        request.uow = uow
+        try:
+            return handle_user(request, module_name, user, token, cfg)
+        finally:
+            request.uow = None
+
+
+def handle_user(request, module_name, user, token, cfg):
+    """
+    Answer the request of an authenticated user.
+    """
+    query_params = request.query_params
+    id = None
+    task = {}
+
+    if module_name == "list" and "id" not in query_params:
+        # concurrent refreshes of the same list share one query and rendering
+        return flight.do(
+            ("list", user),
+            lambda: list_task_table(
+                request, tasks.list_tasks(user=user, uow=request.uow)
+            ),
+        )
+
+    # the task list of the user is only read, so we use the catalog's own copy
+    task_list = catalog.catalog.user_tasks(user).tasks
+    # if we want to show, do or veto a task, we need to load it first
+    if "id" in query_params:
+        id = int(query_params["id"][0])
+        if id >= len(task_list):
+            pending = tasks.get_pending_task(user, uow=request.uow)
+            if pending is not None:
+                pending["token"] = token
+                pending["user"] = user
+                return Response(
+                    body=show_page(request, pending, "task_not_found_pending.tpl")
+                )
+            return Response(
+                body=show_page(
+                    request, {"token": token, "user": user}, "task_not_found.tpl"
+                )
+            )
+        # only the task we act on is copied and enriched with its status
+        task = tasks.get_task(user, id, uow=request.uow)
+        task["token"] = token
+        task["user"] = user
+        task["index"] = id
+
+    if module_name == "debug":
+        return show_debug(request, cfg)
+    elif module_name == "voucher":
+        inline = query_params.get("inline", [""])[0] in ("1", "true", "yes")
+        return list_vouchers(
+            request, user=user, token=token, task_list=task_list, inline=inline
+        )
+    elif module_name == "list":
+        return list_task_table(request, tasks.list_tasks(user=user, uow=request.uow))
+
+    help_needed = not tasks.get_help_status(user=user, uow=request.uow)
+
+    if help_needed or module_name == "help":
+        return show_help(request, user=user, id=id, task=task)
+    elif module_name == "show":
+        return show_task(request, user=user, id=id, task=task)
+    elif module_name == "do":
+        return do_task(request, user=user, id=id, task=task)
+    elif module_name == "veto":
+        return veto_task(request, user=user, id=id, task=task)
+    return Response(404, b"Module not found", TEXT)
+
+
+def prerender_markdown():
+    """
+    Render the markdown of all tasks in the catalog into the cache.
+    """
+    count = 0
+    for user in catalog.catalog.users():
+        for task in catalog.catalog.user_tasks(user).tasks:
+            for field in ("when", "description"):
+                if field in task:
+                    templating.render_markdown(task[field])
+                    count += 1
+    return count
+
+
+def startup(reload_templates=False, prerender=False):
+    """
+    Prepare the application before serving the first request. Raises a
+    TemplateError if a template is missing or malformed.
+    """
+    templating.registry.reload = reload_templates
+    templating.registry.load(required=TEMPLATES)
+    if prerender:
+        prerender_markdown()
+
+
+def application(environ, start_response):
+    """
+    The WSGI entry point.
+    """
+    response = handle(Request(environ))
+    start_response(response.status_line, response.wsgi_headers())
+    return [response.body]
@@ -0,0 +1,190 @@
+"""
+Module to serve the tasks pages from an asyncio event loop.
+
+Connections are handled by the event loop: a client that is slow to send
+its request, or keeps its connection open between requests, only costs a
+coroutine. Once a request is read completely, it is answered by the WSGI
+application in app.py, on a bounded pool of executor threads, because the
+database, the QR code generation and the rendering are blocking work.
+
+    python aserver.py [--port PORT] [--workers N] [--idle-timeout SECONDS]
+
+The defaults are taken from the "server" section of config.json.
+"""
+
+import argparse
+import asyncio
+import io
+import signal
+import traceback
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import server
+
+EXECUTOR_WORKERS = 8
+IDLE_TIMEOUT = 30
+MAX_HEADER_SIZE = 65536
+
+ERROR_RESPONSE = (
+    b"HTTP/1.0 500 Internal Server Error\r\n"
+    b"Content-Type: text/plain; charset=utf-8\r\n"
+    b"Content-Length: 21\r\n"
+    b"Connection: close\r\n\r\n"
+    b"Internal Server Error"
+)
+
+
+class BufferedRequestHandler(server.RequestHandler):
+    """
+    RequestHandler answering one request read by the event loop, with the
+    response collected in memory instead of written to a socket.
+    """
+
+    def __init__(self, raw_request, client_address, server_info):
+        self.rfile = io.BytesIO(raw_request)
+        self.wfile = io.BytesIO()
+        self.client_address = client_address
+        self.server = server_info
+        self.idle_timeout = server_info.idle_timeout
+        self.close_connection = True
+        self.handle_one_request()
+
+    def response(self):
+        return self.wfile.getvalue()
+
+
+class AsyncServer:
+    """
+    Accept connections on the event loop and answer their requests on the
+    executor.
+    """
+
+    def __init__(
+        self,
+        host="",
+        port=server.LISTENING_PORT,
+        workers=EXECUTOR_WORKERS,
+        idle_timeout=IDLE_TIMEOUT,
+    ):
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="http-executor"
+        )
+        self.info = types.SimpleNamespace(
+            server_name=host or "localhost", server_port=port, idle_timeout=idle_timeout
+        )
+        self.connections = 0
+        self._loop = None
+        self._stopped = None
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        client_address = writer.get_extra_info("peername")
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    # an idle or slow client only waits here, without holding a thread
+                    raw_request = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), self.idle_timeout
+                    )
+                except (
+                    asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError,
+                    asyncio.TimeoutError,
+                    ConnectionError,
+                ):
+                    break
+                try:
+                    handler = await loop.run_in_executor(
+                        self.executor,
+                        BufferedRequestHandler,
+                        raw_request,
+                        client_address,
+                        self.info,
+                    )
+                except Exception:
+                    traceback.print_exc()
+                    writer.write(ERROR_RESPONSE)
+                    await writer.drain()
+                    break
+                writer.write(handler.response())
+                await writer.drain()
+                if handler.close_connection:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def serve(self):
+        """
+        Serve until stop() is called, then finish the running requests.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        listener = await asyncio.start_server(
+            self.handle, self.host or None, self.port, limit=MAX_HEADER_SIZE
+        )
+        async with listener:
+            await self._stopped.wait()
+        await self._loop.run_in_executor(None, self.executor.shutdown)
+
+    def stop(self):
+        """
+        Stop serving; safe to call from any thread.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+
+def parse_args(argv=None):
+    settings = server.server_settings()
+    parser = argparse.ArgumentParser(description="Serve the tasks pages with asyncio.")
+    parser.add_argument(
+        "--port", type=int, default=settings.get("port", server.LISTENING_PORT)
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.get("workers", EXECUTOR_WORKERS),
+        help="number of executor threads answering requests",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=settings.get("idle_timeout", IDLE_TIMEOUT),
+        help="seconds to wait for the next request on a connection",
+    )
+    server.add_startup_arguments(parser, settings)
+    return parser.parse_args(argv)
+
+
+async def run(args):
+    httpd = AsyncServer(
+        port=args.port, workers=args.workers, idle_timeout=args.idle_timeout
+    )
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, httpd.stop)
+    print(f"Starting asyncio server on port {args.port}...")
+    await httpd.serve()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server.startup(args)
+    with server.serving():
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark of the status query behind tasks.list_tasks.
+
+We compare the former query (three correlated sub-selects per action row,
+joined to the tasks with a nested loop) with the aggregated pivot query
+joined through a dict, for a growing action log of a single user.
+
+Usage: python bench_list_tasks.py [max_actions]
+"""
+
+import sqlite3
+import sys
+import time
+
+import tasks
+
+LEGACY_QUERY = (
+    "select distinct"
+    "	t_main.id, "
+    "	(select action_at from tasks where id = t_main.id and user = t_main.user and action = 'show') as shown_at, "
+    "	(select action_at from tasks where id = t_main.id and user = t_main.user and action = 'veto') as vetoed_at, "
+    "	(select action_at from tasks where id = t_main.id and user = t_main.user and action = 'done') as done_at "
+    "from "
+    "	tasks t_main "
+    "where "
+    "	user = ?;"
+)
+
+ACTIONS = ("help", "found", "show", "done")
+USER = "bench_user"
+
+
+def build_db(actions):
+    """
+    Create an in-memory database holding the given number of action rows.
+    """
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE tasks (user TEXT, id TEXT, action_at TIMESTAMP, action TEXT)"
+    )
+    rows = [
+        (
+            USER,
+            f"task-{idx // len(ACTIONS)}",
+            "2026-01-01 00:00:00",
+            ACTIONS[idx % len(ACTIONS)],
+        )
+        for idx in range(actions)
+    ]
+    conn.executemany("INSERT INTO tasks VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    task_list = [{"id": f"task-{idx}"} for idx in range(actions // len(ACTIONS) + 1)]
+    return conn, task_list
+
+
+def legacy_list(conn, task_list):
+    rows = conn.execute(LEGACY_QUERY, (USER,)).fetchall()
+    for row in rows:
+        for task in task_list:
+            if task["id"] == row[0]:
+                task["shown_at"], task["vetoed_at"], task["done_at"] = row[1:]
+                break
+    return task_list
+
+
+def pivot_list(conn, task_list):
+    action_times = {
+        row[0]: row[1:] for row in conn.execute(tasks.LIST_TASKS_QUERY, (USER,))
+    }
+    for task in task_list:
+        times = action_times.get(task["id"])
+        if times is not None:
+            task["shown_at"], task["vetoed_at"], task["done_at"] = times
+    return task_list
+
+
+def measure(function, conn, task_list, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(conn, [dict(task) for task in task_list])
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv):
+    max_actions = int(argv[1]) if len(argv) > 1 else 8000
+    print(f"{'actions':>8} {'legacy [ms]':>12} {'pivot [ms]':>12} {'speedup':>8}")
+    actions = 250
+    while actions <= max_actions:
+        conn, task_list = build_db(actions)
+        assert legacy_list(conn, [dict(t) for t in task_list]) == pivot_list(
+            conn, [dict(t) for t in task_list]
+        )
+        legacy = measure(legacy_list, conn, task_list)
+        pivot = measure(pivot_list, conn, task_list)
+        conn.close()
+        print(
+            f"{actions:>8} {legacy * 1000:>12.2f} {pivot * 1000:>12.2f} {legacy / pivot:>7.1f}x"
+        )
+        actions *= 2
+
+
+if __name__ == "__main__":
+    main(sys.argv)
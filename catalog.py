@@ -0,0 +1,114 @@
+"""
+Module to encapsulate reading of the task catalog (tasks.json).
+
+The catalog is parsed once per process and split by user into a tuple of
+read-only tasks plus a map from task id to index. It is parsed again only
+when tasks.json changes on disk. The hot path reads the tasks read-only
+and copies only the single task it enriches for display, so neither the
+shared catalog is touched nor a whole task list copied per request.
+"""
+
+import json
+import threading
+
+import config
+
+TASKS_FILE = "tasks.json"
+
+
+class UserTasks:
+    """
+    The compiled task list of a single user.
+    """
+
+    def __init__(self, tasks):
+        self.tasks = config.freeze(tasks)
+        self.index = {task["id"]: idx for idx, task in enumerate(self.tasks)}
+
+    def __len__(self):
+        return len(self.tasks)
+
+
+class TaskCatalog:
+    """
+    Process-wide cache of tasks.json, compiled per user.
+    """
+
+    def __init__(self, path=TASKS_FILE):
+        self.path = path
+        self.hits = 0
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._users = None
+        self._signature = None
+
+    def _load(self, signature):
+        with open(self.path) as tasks_file:
+            raw = json.load(tasks_file)
+        self._users = {user: UserTasks(data["tasks"]) for user, data in raw.items()}
+        self._signature = signature
+        self.reloads += 1
+
+    def _current(self):
+        signature = config.file_signature(self.path)
+        with self._lock:
+            if self._users is None or signature != self._signature:
+                self._load(signature)
+            else:
+                self.hits += 1
+            return self._users
+
+    def reload(self):
+        """
+        Parse tasks.json again, regardless of its signature.
+        """
+        with self._lock:
+            self._load(config.file_signature(self.path))
+
+    def users(self):
+        """
+        Return the names of all users with a task list.
+        """
+        return list(self._current())
+
+    def user_tasks(self, user):
+        """
+        Return the compiled (read-only) tasks of the given user.
+        """
+        return self._current()[user]
+
+    def get_tasks(self, user):
+        """
+        Return a copy of the task list of the given user.
+        """
+        return [config.thaw(task) for task in self.user_tasks(user).tasks]
+
+    def get_task(self, user, index):
+        """
+        Return a copy of a single task of the given user.
+        """
+        return config.thaw(self.user_tasks(user).tasks[index])
+
+    def index_of(self, user, task_id):
+        """
+        Return the position of the task with the given id, or None.
+        """
+        return self.user_tasks(user).index.get(task_id)
+
+    def stats(self):
+        return {"hits": self.hits, "reloads": self.reloads}
+
+
+catalog = TaskCatalog()
+
+
+def get_tasks(user):
+    return catalog.get_tasks(user)
+
+
+def get_task(user, index):
+    return catalog.get_task(user, index)
+
+
+def index_of(user, task_id):
+    return catalog.index_of(user, task_id)
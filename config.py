@@ -1,17 +1,177 @@
 """
 Moduole to encapsulate configuration reading.
+
+The configuration is parsed once per process and kept in a ConfigStore.
+The store hands out an immutable snapshot of config.json and only parses
+the file again when its mtime or size changes, or when reload() is called.
+Together with each snapshot the store builds a token index, so that
+resolving a token to a user does not depend on the number of users.
 """
 
+import hashlib
+import hmac
 import json
+import os
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+
+CONFIG_FILE = "config.json"
+NEGATIVE_CACHE_SIZE = 1024
+
+
+def freeze(value):
+    """
+    Turn the parsed JSON into read-only structures, so that no caller
+    can modify the shared snapshot by accident.
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def file_signature(path):
+    """
+    Identify a version of a file by path, inode, modification time and size.
+    """
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _token_key(token):
+    return hashlib.sha256(str(token).encode("utf-8")).digest()
+
+
+def build_token_index(config):
+    """
+    Map the digest of every user token to (user name, token).
+    """
+    return {
+        _token_key(user_info["token"]): (user_name, str(user_info["token"]))
+        for user_name, user_info in config["users"].items()
+    }
+
+
+def thaw(value):
+    """
+    Return a plain (mutable) copy of a frozen snapshot, e.g. for printing.
+    """
+    if isinstance(value, MappingProxyType):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+class ConfigStore:
+    """
+    Process-wide cache of the parsed configuration file.
+
+    get() returns the current snapshot and re-reads the file only if its
+    signature (path, inode, mtime, size) changed since the last parse.
+    Unknown tokens are remembered in a bounded LRU cache, which is cleared
+    whenever the configuration is reloaded.
+    """
+
+    def __init__(self, path=CONFIG_FILE, negative_cache_size=NEGATIVE_CACHE_SIZE):
+        self.path = path
+        self.hits = 0
+        self.reloads = 0
+        self.negative_hits = 0
+        self.negative_cache_size = negative_cache_size
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._signature = None
+        self._token_index = {}
+        self._unknown_tokens = OrderedDict()
+
+    def _load(self, signature):
+        with open(self.path) as config_file:
+            self._snapshot = freeze(json.load(config_file))
+        self._token_index = build_token_index(self._snapshot)
+        self._unknown_tokens.clear()
+        self._signature = signature
+        self.reloads += 1
+
+    def get(self):
+        """
+        Return the current configuration snapshot.
+        """
+        signature = file_signature(self.path)
+        with self._lock:
+            if self._snapshot is None or signature != self._signature:
+                self._load(signature)
+            else:
+                self.hits += 1
+            return self._snapshot
+
+    def reload(self):
+        """
+        Parse the configuration file again, regardless of its signature.
+        """
+        with self._lock:
+            self._load(file_signature(self.path))
+            return self._snapshot
+
+    def lookup_token(self, config, token):
+        """
+        Return the user owning the token in the given snapshot, or None.
+        """
+        if config is not self._snapshot:
+            # a snapshot we do not manage (e.g. a plain dict), so we index it on the fly
+            return _match_token(build_token_index(config), token)
+        key = _token_key(token)
+        with self._lock:
+            if config is not self._snapshot:
+                # the configuration was reloaded in the meantime
+                return _match_token(build_token_index(config), token)
+            if key in self._unknown_tokens:
+                self._unknown_tokens.move_to_end(key)
+                self.negative_hits += 1
+                return None
+            user = _match_token(self._token_index, token, key)
+            if user is None:
+                self._unknown_tokens[key] = True
+                if len(self._unknown_tokens) > self.negative_cache_size:
+                    self._unknown_tokens.popitem(last=False)
+            return user
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "reloads": self.reloads,
+            "negative_hits": self.negative_hits,
+            "unknown_tokens": len(self._unknown_tokens),
+        }
+
+
+store = ConfigStore()
 
 
 def read_config():
-    config = json.load(open("config.json"))
-    return config
+    return store.get()
 
 
-def get_user_from_token(config, token):
-    for user_name, user_info in config["users"].items():
-        if user_info["token"] == token:
-            return user_name
+def reload_config():
+    return store.reload()
+
+
+def _match_token(token_index, token, key=None):
+    """
+    Look up the token by its digest and compare it in constant time.
+    """
+    if key is None:
+        key = _token_key(token)
+    entry = token_index.get(key)
+    if entry is None:
+        return None
+    user_name, user_token = entry
+    if hmac.compare_digest(user_token.encode("utf-8"), str(token).encode("utf-8")):
+        return user_name
     return None
+
+
+def get_user_from_token(config, token):
+    return store.lookup_token(config, token)
@@ -0,0 +1,232 @@
+"""
+Module to encapsulate the connections to the tasks database.
+
+Every thread keeps one long-lived connection per database file. Each new
+connection switches the database to WAL mode, so readers do not block the
+writer, relaxes fsyncs to synchronous=NORMAL and waits busy_timeout
+milliseconds for a lock instead of failing with "database is locked".
+The timeout can be set in config.json under database.busy_timeout.
+
+A UnitOfWork groups everything one HTTP request does into a single
+transaction on that connection: reads see one consistent snapshot, repeated
+reads are answered from memory, and all writes are committed at once.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import config
+import schema
+
+BUSY_TIMEOUT = 5000
+CACHED_STATEMENTS = 256
+
+_local = threading.local()
+
+
+def _busy_timeout():
+    try:
+        return (
+            config.read_config().get("database", {}).get("busy_timeout", BUSY_TIMEOUT)
+        )
+    except FileNotFoundError:
+        return BUSY_TIMEOUT
+
+
+def _open(db_name):
+    schema.ensure_schema(db_name)
+    busy_timeout = _busy_timeout()
+    conn = sqlite3.connect(
+        db_name, timeout=busy_timeout / 1000, cached_statements=CACHED_STATEMENTS
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+    return conn
+
+
+def get_connection(db_name):
+    """
+    Return the connection of the current thread to the given database file.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    path = os.path.abspath(db_name)
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = _open(db_name)
+    return conn
+
+
+class UnitOfWork:
+    """
+    One connection and one transaction for a whole request.
+
+    Use it as a context manager and pass it to the functions in tasks.py.
+    With write=True the write lock is taken up front (BEGIN IMMEDIATE), so a
+    request that reads first and writes later cannot fail to upgrade its
+    snapshot. Callbacks registered with after_commit() run once the
+    transaction is committed, e.g. to send notifications.
+    """
+
+    def __init__(self, db_name, write=False):
+        self.db_name = db_name
+        self.path = os.path.abspath(db_name)
+        self.write = write
+        self.conn = None
+        self.round_trips = 0
+        self._outer = None
+        self._reads = {}
+        self._after_commit = []
+
+    def __enter__(self):
+        if open_unit_of_work(self.db_name) is not None:
+            # SQLite has no nested transactions on one connection
+            raise RuntimeError(
+                f"a unit of work on {self.db_name} is already open in this thread, "
+                "pass it on as uow instead"
+            )
+        self.conn = get_connection(self.db_name)
+        self.conn.execute("BEGIN IMMEDIATE" if self.write else "BEGIN")
+        # a unit of work opened inside another one hands the thread back to it
+        self._outer = current_unit_of_work()
+        _local.unit_of_work = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.unit_of_work, self._outer = self._outer, None
+        callbacks, self._after_commit = self._after_commit, []
+        self._reads.clear()
+        if exc_type is not None:
+            self.conn.rollback()
+            return False
+        self.conn.commit()
+        # the transaction is committed already, so a failing callback must
+        # neither undo it nor keep the remaining callbacks from running
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as error:
+                print(f"After-commit callback failed: {error}")
+        return False
+
+    def read(self, key, loader):
+        """
+        Return the result of loader(), remembered under key until the next write.
+        """
+        if key not in self._reads:
+            self._reads[key] = loader()
+        return self._reads[key]
+
+    def changed(self):
+        """
+        Forget all remembered reads, as the data was modified.
+        """
+        self._reads.clear()
+
+    def after_commit(self, callback):
+        self._after_commit.append(callback)
+
+
+def current_unit_of_work():
+    """
+    Return the unit of work open in the current thread, if any.
+    """
+    return getattr(_local, "unit_of_work", None)
+
+
+def open_unit_of_work(db_name):
+    """
+    Return the unit of work open on the given database file in the current
+    thread, if any; one on another file is never joined.
+    """
+    path = os.path.abspath(db_name)
+    uow = current_unit_of_work()
+    while uow is not None and uow.path != path:
+        uow = uow._outer
+    return uow
+
+
+@contextmanager
+def connection(db_name, uow=None):
+    """
+    Use the pooled connection of the current thread. Changes are committed
+    when the block ends and rolled back if it raises.
+
+    Inside a unit of work on the same file the block joins its transaction
+    instead; the unit of work commits or rolls back at its end.
+    """
+    if uow is None:
+        uow = open_unit_of_work(db_name)
+    if uow is not None:
+        uow.round_trips += 1
+        yield uow.conn
+        return
+    conn = get_connection(db_name)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+@contextmanager
+def transaction(db_name, uow=None):
+    """
+    Join the given unit of work, or the one open on db_name, or run the
+    block in a new one.
+    """
+    if uow is None:
+        uow = open_unit_of_work(db_name)
+    if uow is not None:
+        yield uow
+        return
+    with UnitOfWork(db_name, write=True) as uow:
+        yield uow
+
+
+def cached_read(db_name, uow, key, loader):
+    """
+    Run loader() once per unit of work, or on every call without one.
+    """
+    if uow is None:
+        uow = open_unit_of_work(db_name)
+    if uow is None:
+        return loader()
+    return uow.read(key, loader)
+
+
+def changed(db_name, uow):
+    """
+    Tell the unit of work, if any, that its remembered reads are outdated.
+    """
+    if uow is None:
+        uow = open_unit_of_work(db_name)
+    if uow is not None:
+        uow.changed()
+
+
+def after_commit(db_name, uow, callback):
+    """
+    Run callback once the unit of work is committed, or at once without one.
+    """
+    if uow is None:
+        uow = open_unit_of_work(db_name)
+    if uow is None:
+        callback()
+    else:
+        uow.after_commit(callback)
+
+
+def close_connections():
+    """
+    Close all connections of the current thread.
+    """
+    connections = getattr(_local, "connections", {})
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
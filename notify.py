@@ -1,11 +1,294 @@
 """
 We send mails to notify a user about tasks being found, shown, done, or vetoed.
+
+Request handlers do not talk to the mail server themselves: they enqueue
+the notification with enqueue_notification_email() and return. A small
+pool of worker threads delivers the queued mails in the background.
+The pool size and queue length can be set in config.json under
+email.workers and email.queue_size.
+
+With email.digest_window set to a number of seconds, the notifications
+for one recipient are collected for that long and sent as one mail; the
+default of 0 sends every notification on its own.
+
+The workers share a pool of authenticated SMTP sessions, so that not every
+mail pays for a TCP connect, STARTTLS and login. The pool is configured
+under email.pool_size, email.max_messages_per_connection and
+email.max_connection_age (seconds).
+
+Every session uses email.connect_timeout and email.timeout (seconds), so an
+unreachable mail server cannot hang a worker. After email.breaker_threshold
+consecutive failures a circuit breaker stops talking to the mail server for
+email.breaker_cooldown seconds; during that time sending fails at once
+(the outbox retries those mails later).
 """
 
+import atexit
+import queue
+import threading
+import time
 from email.message import EmailMessage
-from smtplib import SMTP
+from smtplib import (
+    SMTP,
+    SMTPDataError,
+    SMTPException,
+    SMTPRecipientsRefused,
+    SMTPSenderRefused,
+    SMTPServerDisconnected,
+)
 from config import read_config
 
+WORKERS = 2
+QUEUE_SIZE = 1000
+SHUTDOWN_TIMEOUT = 10
+POOL_SIZE = 2
+MAX_MESSAGES = 100
+MAX_AGE = 300
+DIGEST_WINDOW = 0
+CONNECT_TIMEOUT = 10
+TIMEOUT = 30
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60
+
+# errors where the mail server answered, so it is not down
+REJECTIONS = (SMTPRecipientsRefused, SMTPSenderRefused, SMTPDataError)
+
+
+class CircuitOpenError(SMTPException):
+    """
+    Raised instead of contacting a mail server that failed repeatedly;
+    retry_after is the number of seconds until the breaker lets a trial
+    through again.
+    """
+
+    def __init__(self, message, retry_after=0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures of the mail server.
+
+    closed: mails are sent normally.
+    open: after threshold failures, sending fails at once for cooldown seconds.
+    half-open: after the cooldown a single trial is let through; its success
+    closes the breaker again, its failure re-opens it.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.rejected = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Return True if we may contact the mail server now.
+        """
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    self.rejected += 1
+                    return False
+                self.state = "half-open"
+            if self.state == "half-open":
+                if self._trial:
+                    self.rejected += 1
+                    return False
+                self._trial = True
+            return True
+
+    def retry_after(self):
+        """
+        Return the seconds until the cooldown of an open breaker ends.
+        """
+        with self._lock:
+            if self.state != "open":
+                return 0
+            return max(0, self.opened_at + self.cooldown - time.monotonic())
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.state == "half-open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    print(f"Mail server failed {self.failures} times, pausing")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "rejected": self.rejected,
+            }
+
+
+class SMTPPool:
+    """
+    Authenticated SMTP sessions, kept open and reused for many mails.
+
+    A session is checked with NOOP before it is reused, and closed after
+    max_messages mails or max_age seconds. At most size sessions are open
+    at the same time.
+    """
+
+    def __init__(
+        self,
+        settings,
+        size=POOL_SIZE,
+        max_messages=MAX_MESSAGES,
+        max_age=MAX_AGE,
+        breaker=None,
+    ):
+        self.settings = settings
+        self.size = size
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self.connect_timeout = settings.get("connect_timeout", CONNECT_TIMEOUT)
+        self.timeout = settings.get("timeout", TIMEOUT)
+        self.breaker = breaker or CircuitBreaker()
+        self.connects = 0
+        self.reuses = 0
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        server = SMTP(
+            self.settings["smtp_server"],
+            self.settings["smtp_port"],
+            timeout=self.connect_timeout,
+        )
+        # once connected, every command may take at most timeout seconds
+        server.sock.settimeout(self.timeout)
+        server.starttls()
+        server.login(self.settings["smtp_username"], self.settings["smtp_password"])
+        with self._lock:
+            self.connects += 1
+        return {"server": server, "opened_at": time.monotonic(), "messages": 0}
+
+    def _expired(self, session):
+        return (
+            session["messages"] >= self.max_messages
+            or time.monotonic() - session["opened_at"] >= self.max_age
+        )
+
+    def _alive(self, session):
+        try:
+            return session["server"].noop()[0] == 250
+        except Exception:
+            return False
+
+    def _close(self, session):
+        try:
+            session["server"].quit()
+        except Exception:
+            pass
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                session = self._idle.pop() if self._idle else None
+            if session is None:
+                return self._connect()
+            if not self._expired(session) and self._alive(session):
+                with self._lock:
+                    self.reuses += 1
+                return session
+            self._close(session)
+
+    def send(self, msg):
+        """
+        Send the message over a pooled session, reconnecting once if the
+        server dropped the connection. Raises CircuitOpenError while the
+        circuit breaker is open.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(
+                "mail server unavailable, circuit breaker is open",
+                retry_after=self.breaker.retry_after(),
+            )
+        with self._slots:
+            session = None
+            try:
+                session = self._checkout()
+                try:
+                    session["server"].send_message(msg)
+                except SMTPServerDisconnected:
+                    self._close(session)
+                    session = self._connect()
+                    session["server"].send_message(msg)
+            except Exception as error:
+                if isinstance(error, REJECTIONS):
+                    self.breaker.success()
+                else:
+                    self.breaker.failure()
+                if session is not None:
+                    self._close(session)
+                raise
+            self.breaker.success()
+            session["messages"] += 1
+            with self._lock:
+                self._idle.append(session)
+
+    def close(self):
+        """
+        Close all idle sessions.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            self._close(session)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the SMTP pool for the current mail settings, replacing the pool
+    if the settings changed in config.json.
+    """
+    global _pool
+    email = read_config()["email"]
+    with _pool_lock:
+        if _pool is None or _pool.settings != email:
+            if _pool is not None:
+                _pool.close()
+            _pool = SMTPPool(
+                email,
+                size=email.get("pool_size", POOL_SIZE),
+                max_messages=email.get("max_messages_per_connection", MAX_MESSAGES),
+                max_age=email.get("max_connection_age", MAX_AGE),
+                breaker=CircuitBreaker(
+                    threshold=email.get("breaker_threshold", BREAKER_THRESHOLD),
+                    cooldown=email.get("breaker_cooldown", BREAKER_COOLDOWN),
+                ),
+            )
+        return _pool
+
+
+def breaker_state():
+    """
+    Return the state of the circuit breaker in front of the mail server.
+    """
+    return get_pool().breaker.stats()
+
 
 def send_notification_email(user_email, subject, body):
     """
@@ -14,18 +297,247 @@ def send_notification_email(user_email, subject, body):
     :param user_email: The email address of the user to notify.
     :param subject: The subject of the email.
     :param body: The body content of the email.
-    :param smtp_server: The SMTP server to use for sending the email.
-    :param smtp_port: The port of the SMTP server.
     """
-    config = read_config()
+    pool = get_pool()
     msg = EmailMessage()
-    server = SMTP(config["email"]["smtp_server"], config["email"]["smtp_port"])
-    server.starttls()
-    server.login(config["email"]["smtp_username"], config["email"]["smtp_password"])
-    msg["From"] = config["email"]["from_address"]
+    msg["From"] = pool.settings["from_address"]
     msg["To"] = user_email
     msg["Subject"] = subject
     msg.set_content(body)
     print(f"Sending email to {user_email} with subject '{subject}'")
-    server.send_message(msg)
-    server.quit()
+    pool.send(msg)
+
+
+def compose_digest(events):
+    """
+    Combine (subject, body) pairs for one recipient into a single mail.
+    """
+    if len(events) == 1:
+        return events[0]
+    subject = f"{len(events)} Task Notifications"
+    body = "\n\n".join(f"{subject}:\n{body}" for subject, body in events)
+    return subject, body
+
+
+class NotificationDispatcher:
+    """
+    A bounded queue of notifications, delivered by a pool of worker threads.
+
+    With a digest_window (seconds) the notifications are first collected per
+    recipient, and everything a recipient got within the window is sent as
+    one combined mail.
+    """
+
+    def __init__(
+        self, workers=WORKERS, queue_size=QUEUE_SIZE, digest_window=DIGEST_WINDOW
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.digest_window = digest_window
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.digested = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._closed = False
+        self._digests = {}
+        self._digest_condition = threading.Condition()
+        self._digest_thread = None
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"notify-{number}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        if self.digest_window > 0:
+            self._digest_thread = threading.Thread(
+                target=self._collect, name="notify-digest", daemon=True
+            )
+            self._digest_thread.start()
+
+    def _drop(self, user_email, reason):
+        with self._lock:
+            self.dropped += 1
+        print(f"Notification {reason}, dropping email to {user_email}")
+        return False
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            return self._drop(item[1], "queue full")
+        return True
+
+    def enqueue(self, user_email, subject, body, on_done=None):
+        """
+        Queue a notification; returns False if it had to be dropped.
+
+        on_done, if given, is called with None once the mail is sent, or with
+        the error if sending failed.
+        """
+        if self._closed:
+            return self._drop(user_email, "dispatcher closed")
+        if self.digest_window > 0:
+            with self._digest_condition:
+                buffered = sum(len(events) for _, events in self._digests.values())
+                if buffered >= self.queue_size:
+                    return self._drop(user_email, "digest buffer full")
+                _, events = self._digests.setdefault(user_email, (time.monotonic(), []))
+                events.append((subject, body, on_done))
+                self._digest_condition.notify()
+        elif not self._put(
+            (time.monotonic(), user_email, subject, body, [on_done] if on_done else [])
+        ):
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _collect(self):
+        """
+        Hand every digest whose window has passed to the workers; on
+        shutdown hand over all of them.
+        """
+        with self._digest_condition:
+            while True:
+                now = time.monotonic()
+                for user_email, (queued_at, events) in list(self._digests.items()):
+                    if self._closed or now - queued_at >= self.digest_window:
+                        del self._digests[user_email]
+                        subject, body = compose_digest(
+                            [(subject, body) for subject, body, _ in events]
+                        )
+                        callbacks = [on_done for _, _, on_done in events if on_done]
+                        item = (queued_at, user_email, subject, body, callbacks)
+                        if self._put(item):
+                            with self._lock:
+                                self.digested += len(events)
+                if self._closed:
+                    return
+                timeout = None
+                if self._digests:
+                    first = min(queued_at for queued_at, _ in self._digests.values())
+                    timeout = max(0, first + self.digest_window - now)
+                self._digest_condition.wait(timeout)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            queued_at, user_email, subject, body, callbacks = item
+            result = None
+            try:
+                send_notification_email(user_email, subject=subject, body=body)
+            except Exception as error:
+                result = error
+                with self._lock:
+                    self.failed += 1
+                print(f"Sending email to {user_email} failed: {error}")
+            else:
+                latency = time.monotonic() - queued_at
+                with self._lock:
+                    self.sent += 1
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+            finally:
+                for callback in callbacks:
+                    try:
+                        callback(result)
+                    except Exception as error:
+                        print(f"Notification callback failed: {error}")
+                self._queue.task_done()
+
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        """
+        Stop accepting notifications and wait until the queued ones (and the
+        collected digests) are delivered, at most timeout seconds. Returns
+        True if the queue drained.
+        """
+        deadline = time.monotonic() + timeout
+        with self._digest_condition:
+            self._closed = True
+            self._digest_condition.notify_all()
+        if self._digest_thread is not None:
+            self._digest_thread.join(max(0, deadline - time.monotonic()))
+        for _ in self._threads:
+            try:
+                self._queue.put(None, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def stats(self):
+        with self._lock:
+            delivered = self.sent or 1
+            return {
+                "queue_depth": self._queue.qsize(),
+                "enqueued": self.enqueued,
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "digested": self.digested,
+                "average_latency": self.total_latency / delivered,
+                "max_latency": self.max_latency,
+            }
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+    Return the dispatcher of this process, starting it on first use.
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                email = read_config()["email"]
+                dispatcher = NotificationDispatcher(
+                    workers=email.get("workers", WORKERS),
+                    queue_size=email.get("queue_size", QUEUE_SIZE),
+                    digest_window=email.get("digest_window", DIGEST_WINDOW),
+                )
+                dispatcher.start()
+                _dispatcher = dispatcher
+    return _dispatcher
+
+
+def enqueue_notification_email(user_email, subject, body, on_done=None):
+    """
+    Hand a notification to the background workers and return at once.
+    """
+    return get_dispatcher().enqueue(
+        user_email, subject=subject, body=body, on_done=on_done
+    )
+
+
+def shutdown(timeout=SHUTDOWN_TIMEOUT):
+    """
+    Deliver the queued notifications, stop the dispatcher, if running, and
+    close the idle SMTP sessions.
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        dispatcher, _dispatcher = _dispatcher, None
+    drained = True if dispatcher is None else dispatcher.shutdown(timeout)
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+    return drained
+
+
+# queued notifications are delivered before the process exits
+atexit.register(shutdown)
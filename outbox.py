@@ -0,0 +1,271 @@
+"""
+Module to deliver the notifications written to the outbox table.
+
+tasks.py stores every notification in the outbox, in the same transaction
+as the action it reports, so a notification is never lost when the mail
+server is down and never sent for an action that was rolled back.
+
+An OutboxWorker thread per database file claims due rows in batches and
+hands them to the notification dispatcher. A claimed row is leased for a
+while; if the process dies before the result is recorded, the lease runs
+out and the row is delivered again (at-least-once), so the lease must be
+longer than email.digest_window. Rows the dispatcher refuses (queue full,
+shutting down) are released again after release_delay, rows that meet an
+open circuit breaker once its cooldown ends. Failed rows are
+retried with exponential backoff and marked dead after max_attempts.
+The settings live in config.json under outbox.
+"""
+
+import os
+import threading
+import time
+
+import config
+import db
+import notify
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 8
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 3600
+POLL_INTERVAL = 10
+LEASE = 300
+RELEASE_DELAY = 10
+
+
+def add(conn, recipient, subject, body):
+    """
+    Write a notification to the outbox, within the caller's transaction.
+    """
+    conn.execute(
+        "INSERT INTO outbox (recipient, subject, body, created_at) "
+        "VALUES (?, ?, ?, datetime('now'))",
+        (recipient, subject, body),
+    )
+
+
+def retry_delay(attempts, base=RETRY_DELAY, limit=MAX_RETRY_DELAY):
+    """
+    Seconds to wait before the next attempt, doubling with every failure.
+    """
+    return min(limit, base * 2 ** (attempts - 1))
+
+
+class OutboxWorker:
+    """
+    Delivers the due rows of the outbox of one database file.
+    """
+
+    def __init__(
+        self,
+        db_name,
+        dispatcher=None,
+        batch_size=BATCH_SIZE,
+        max_attempts=MAX_ATTEMPTS,
+        retry_delay=RETRY_DELAY,
+        max_retry_delay=MAX_RETRY_DELAY,
+        poll_interval=POLL_INTERVAL,
+        lease=LEASE,
+        release_delay=RELEASE_DELAY,
+    ):
+        self.db_name = os.path.abspath(db_name)
+        self.dispatcher = dispatcher
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.release_delay = release_delay
+        self.refused = 0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self, timeout=notify.SHUTDOWN_TIMEOUT):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                # a full batch means there may be more waiting
+                while self.deliver_due() == self.batch_size:
+                    pass
+            except Exception as error:
+                print(f"Delivering the outbox failed: {error}")
+
+    def claim(self):
+        """
+        Lease a batch of due rows and return them.
+        """
+        now = time.time()
+        with db.UnitOfWork(self.db_name, write=True) as uow:
+            return uow.conn.execute(
+                "UPDATE outbox SET status = 'sending', next_attempt_at = ? "
+                "WHERE msg_id IN ("
+                "    SELECT msg_id FROM outbox "
+                "    WHERE status IN ('pending', 'sending') AND next_attempt_at <= ? "
+                "    ORDER BY msg_id LIMIT ?) "
+                "RETURNING msg_id, recipient, subject, body, attempts",
+                (now + self.lease, now, self.batch_size),
+            ).fetchall()
+
+    def deliver_due(self):
+        """
+        Hand the due rows to the dispatcher; returns the number of rows it
+        accepted.
+        """
+        dispatcher = self.dispatcher or notify.get_dispatcher()
+        rows = self.claim()
+        refused = []
+        for msg_id, recipient, subject, body, attempts in rows:
+            if not dispatcher.enqueue(
+                recipient,
+                subject=subject,
+                body=body,
+                on_done=self._recorder(msg_id, attempts),
+            ):
+                refused.append(msg_id)
+        if refused:
+            # we do not keep the refused rows leased, they are due again shortly
+            self.release(refused)
+            self.refused += len(refused)
+            print(
+                f"Dispatcher refused {len(refused)} notifications, "
+                f"retrying in {self.release_delay}s"
+            )
+        return len(rows) - len(refused)
+
+    def release(self, msg_ids, delay=None):
+        """
+        Give claimed rows back to the outbox without counting an attempt;
+        they are due again after delay seconds, release_delay by default.
+        """
+        if delay is None:
+            delay = self.release_delay
+        next_attempt_at = time.time() + delay
+        with db.connection(self.db_name) as conn:
+            conn.executemany(
+                "UPDATE outbox SET status = 'pending', next_attempt_at = ? "
+                "WHERE msg_id = ? AND status = 'sending'",
+                [(next_attempt_at, msg_id) for msg_id in msg_ids],
+            )
+
+    def _recorder(self, msg_id, attempts):
+        def record(error):
+            self.record(msg_id, attempts, error)
+
+        return record
+
+    def record(self, msg_id, attempts, error=None):
+        """
+        Store the result of a delivery attempt.
+        """
+        if isinstance(error, notify.CircuitOpenError):
+            # the mail server was not contacted, so this was no attempt; the
+            # row waits for the end of the cooldown instead of backing off
+            self.release([msg_id], delay=error.retry_after or self.release_delay)
+            return
+        with db.connection(self.db_name) as conn:
+            if error is None:
+                conn.execute(
+                    "UPDATE outbox SET status = 'sent', sent_at = datetime('now'), "
+                    "attempts = ? WHERE msg_id = ?",
+                    (attempts + 1, msg_id),
+                )
+                return
+            attempts += 1
+            if attempts >= self.max_attempts:
+                status, next_attempt_at = "dead", 0
+                print(f"Giving up on notification {msg_id} after {attempts} attempts")
+            else:
+                status = "pending"
+                delay = retry_delay(attempts, self.retry_delay, self.max_retry_delay)
+                next_attempt_at = time.time() + delay
+            conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, "
+                "last_error = ? WHERE msg_id = ?",
+                (status, attempts, next_attempt_at, str(error), msg_id),
+            )
+
+    def stats(self):
+        with db.connection(self.db_name) as conn:
+            return dict(
+                conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+            )
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def check_lease(lease, digest_window):
+    """
+    Raise a ValueError if a claimed row could still wait in a digest when
+    its lease runs out, and so be claimed and sent a second time.
+    """
+    if lease <= digest_window:
+        raise ValueError(
+            f"outbox.lease ({lease}s) must be longer than "
+            f"email.digest_window ({digest_window}s)"
+        )
+
+
+def get_worker(db_name):
+    """
+    Return the worker of this process for the database file, starting it on
+    first use.
+    """
+    path = os.path.abspath(db_name)
+    with _workers_lock:
+        worker = _workers.get(path)
+        if worker is None:
+            cfg = config.read_config()
+            settings = cfg.get("outbox", {})
+            lease = settings.get("lease", LEASE)
+            check_lease(
+                lease, cfg.get("email", {}).get("digest_window", notify.DIGEST_WINDOW)
+            )
+            worker = OutboxWorker(
+                path,
+                batch_size=settings.get("batch_size", BATCH_SIZE),
+                max_attempts=settings.get("max_attempts", MAX_ATTEMPTS),
+                retry_delay=settings.get("retry_delay", RETRY_DELAY),
+                max_retry_delay=settings.get("max_retry_delay", MAX_RETRY_DELAY),
+                poll_interval=settings.get("poll_interval", POLL_INTERVAL),
+                lease=lease,
+                release_delay=settings.get("release_delay", RELEASE_DELAY),
+            )
+            worker.start()
+            _workers[path] = worker
+        return worker
+
+
+def wake(db_name):
+    """
+    Tell the worker that new rows were committed to the outbox.
+    """
+    get_worker(db_name).wake()
+
+
+def shutdown(timeout=notify.SHUTDOWN_TIMEOUT):
+    """
+    Stop all workers of this process.
+    """
+    with _workers_lock:
+        workers = list(_workers.values())
+        _workers.clear()
+    for worker in workers:
+        worker.stop(timeout)
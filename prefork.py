@@ -0,0 +1,123 @@
+"""
+Module to run a server in several worker processes.
+
+The Supervisor forks a fixed number of workers and keeps them running: a
+worker that exits while the supervisor is not shutting down is replaced by
+a new one. On SIGTERM or SIGINT the supervisor passes SIGTERM on to all
+workers, waits shutdown_timeout seconds for them to finish the requests
+they are handling and kills the remaining ones.
+
+Every worker opens its own listening socket with SO_REUSEPORT, so the
+kernel spreads the connections across the processes. Sockets, database
+connections and threads are all created after the fork; nothing but the
+configuration is shared with the parent.
+"""
+
+import os
+import signal
+import threading
+import time
+import traceback
+
+PROCESSES = os.cpu_count() or 1
+SHUTDOWN_TIMEOUT = 10
+RESTART_DELAY = 1
+
+
+class Supervisor:
+    """
+    Fork processes workers, each calling target(slot), and restart them
+    when they die.
+    """
+
+    def __init__(
+        self,
+        target,
+        processes=PROCESSES,
+        shutdown_timeout=SHUTDOWN_TIMEOUT,
+        restart_delay=RESTART_DELAY,
+    ):
+        self.target = target
+        self.processes = processes
+        self.shutdown_timeout = shutdown_timeout
+        self.restart_delay = restart_delay
+        self.workers = {}
+        self.restarts = 0
+        self._stopping = False
+        self._lock = threading.RLock()
+
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            # we are the worker; the supervisor's signal handlers do not apply here
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            code = 1
+            try:
+                code = self.target(slot) or 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        with self._lock:
+            self.workers[pid] = slot
+            if self._stopping:
+                self._signal(pid, signal.SIGTERM)
+
+    def run(self):
+        """
+        Start the workers and supervise them until stop() is called.
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        for slot in range(self.processes):
+            self._spawn(slot)
+        while True:
+            with self._lock:
+                if not self.workers:
+                    break
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            with self._lock:
+                slot = self.workers.pop(pid, None)
+                stopping = self._stopping
+            if slot is None or stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            print(f"Worker {pid} exited with {code}, restarting it")
+            self.restarts += 1
+            # we do not want to fork in a tight loop if workers die at startup
+            time.sleep(self.restart_delay)
+            if not self._stopping:
+                self._spawn(slot)
+
+    def stop(self, signum=None, frame=None):
+        """
+        Ask all workers to finish, and kill them after shutdown_timeout.
+        """
+        with self._lock:
+            if self._stopping:
+                return
+            self._stopping = True
+            pids = list(self.workers)
+        for pid in pids:
+            self._signal(pid, signal.SIGTERM)
+        timer = threading.Timer(self.shutdown_timeout, self._kill)
+        timer.daemon = True
+        timer.start()
+
+    def _kill(self):
+        with self._lock:
+            pids = list(self.workers)
+        for pid in pids:
+            print(f"Worker {pid} did not stop in time, killing it")
+            self._signal(pid, signal.SIGKILL)
+
+    def _signal(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
@@ -0,0 +1,270 @@
+"""
+Module to cache the QR code images of the voucher links.
+
+A QR code depends on nothing but the encoded text, so each PNG is built
+once and kept in a bounded in-memory cache, and optionally in a directory
+that survives restarts. The codes of a whole voucher sheet are generated
+in parallel on a pool of processes. The settings live in the "qrcode"
+section of config.json:
+
+    "qrcode": {"cache_size": 512, "cache_dir": "qrcache", "processes": 4}
+
+The encoded links contain tokens, so the cache directory must be as
+private as config.json.
+"""
+
+import base64
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import qrcode
+
+import config
+
+CACHE_SIZE = 512
+PARALLEL_THRESHOLD = 4
+# the server runs threads, so the code generating processes are not forked from it
+START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+# bump this when the images change for the same text (QR settings, PNG
+# encoding), so cached files and the browsers' copies are replaced
+FORMAT_VERSION = 1
+
+
+def _key(data):
+    return hashlib.sha256(f"{FORMAT_VERSION}:{data}".encode("utf-8")).hexdigest()
+
+
+def _etag(key):
+    return '"' + key[:32] + '"'
+
+
+def make_png(data):
+    """
+    Encode data as a QR code and return the PNG bytes.
+    """
+    qr = qrcode.QRCode()
+    qr.add_data(data)
+    qr.make()
+    png = BytesIO()
+    qr.make_image().save(png, format="PNG")
+    return png.getvalue()
+
+
+def data_uri(png):
+    """
+    Return the PNG as a data URI, to embed it into a page.
+    """
+    return "data:image/png;base64," + base64.b64encode(png).decode("ascii")
+
+
+def make_etag(data):
+    """
+    Return a strong entity tag for the QR code of data. It follows from the
+    encoded text and FORMAT_VERSION, so it is known before the image is built.
+    """
+    return _etag(_key(data))
+
+
+class QRCodeCache:
+    """
+    Least recently used cache of QR code PNGs, backed by an optional
+    directory.
+    """
+
+    def __init__(
+        self,
+        size=CACHE_SIZE,
+        directory=None,
+        processes=None,
+        parallel_threshold=PARALLEL_THRESHOLD,
+    ):
+        self.size = size
+        self.directory = directory
+        # the number of processes generating codes for get_many(), None for one
+        # per CPU, 0 to generate them in the calling thread
+        self.processes = processes
+        self.parallel_threshold = parallel_threshold
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._images = OrderedDict()
+        self._pool = None
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._images[key] = entry
+            self._images.move_to_end(key)
+            if len(self._images) > self.size:
+                self._images.popitem(last=False)
+
+    def _read(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(os.path.join(self.directory, key + ".png"), "rb") as png_file:
+                return png_file.read()
+        except FileNotFoundError:
+            return None
+        except OSError as error:
+            # an unreadable copy on disk is built again, like a missing one
+            print(f"Cannot read QR code from {self.directory}: {error}")
+            return None
+
+    def _write(self, key, png):
+        if not self.directory:
+            return
+        tmp_path = None
+        try:
+            # we write to a temporary file first, so readers never see half an image
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as png_file:
+                png_file.write(png)
+            os.replace(tmp_path, os.path.join(self.directory, key + ".png"))
+        except OSError as error:
+            # a full or read-only directory costs the copy on disk, not the image
+            print(f"Cannot store QR code in {self.directory}: {error}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return entry
+        png = self._read(key)
+        if png is None:
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        entry = (png, _etag(key))
+        self._remember(key, entry)
+        return entry
+
+    def _store(self, key, png):
+        with self._lock:
+            self.misses += 1
+        self._write(key, png)
+        entry = (png, _etag(key))
+        self._remember(key, entry)
+        return entry
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context(START_METHOD),
+                )
+            return self._pool
+
+    def get(self, data):
+        """
+        Return (PNG bytes, ETag) of the QR code for data.
+        """
+        key = _key(data)
+        entry = self._cached(key)
+        if entry is None:
+            entry = self._store(key, make_png(data))
+        return entry
+
+    def get_many(self, data_list):
+        """
+        Return a map from each distinct data to (PNG bytes, ETag). The codes
+        not cached yet are generated in parallel on a pool of processes.
+        """
+        entries = {}
+        missing = []
+        for data in dict.fromkeys(data_list):
+            entry = self._cached(_key(data))
+            if entry is None:
+                missing.append(data)
+            else:
+                entries[data] = entry
+        pngs = None
+        # for a few codes, starting the work elsewhere costs more than it saves
+        if self.processes != 0 and len(missing) >= self.parallel_threshold:
+            try:
+                pngs = list(self._executor().map(make_png, missing))
+            except BrokenProcessPool:
+                # a crashed pool is replaced on the next call; this one we answer ourselves
+                self.close()
+        if pngs is None:
+            pngs = map(make_png, missing)
+        for data, png in zip(missing, pngs):
+            entries[data] = self._store(_key(data), png)
+        return entries
+
+    def close(self):
+        """
+        Stop the process pool, if it was started.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self._images),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Return the QR code cache of this process, created on first use.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                settings = config.read_config().get("qrcode", {})
+            except FileNotFoundError:
+                settings = {}
+            _cache = QRCodeCache(
+                size=settings.get("cache_size", CACHE_SIZE),
+                directory=settings.get("cache_dir"),
+                processes=settings.get("processes"),
+            )
+        return _cache
+
+
+def get_png(data):
+    return get_cache().get(data)
+
+
+def get_pngs(data_list):
+    return get_cache().get_many(data_list)
+
+
+def shutdown():
+    """
+    Stop the process pool of the cache, if any.
+    """
+    with _cache_lock:
+        cache = _cache
+    if cache is not None:
+        cache.close()
@@ -0,0 +1,304 @@
+"""
+Module to encapsulate the layout of the tasks database.
+
+Every change of the layout is a numbered migration in MIGRATIONS. The
+migrations a database has seen are recorded in the schema_version table,
+so each of them runs exactly once per database file, in order.
+
+ensure_schema() is meant to be called at startup: it migrates a database
+file once per process and afterwards only checks an in-memory set.
+
+The per-user and per-task state summary of an existing database can be
+recomputed from the action log with
+
+    python schema.py rebuild-state [database file]
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+
+# the columns of the action log, the same in every version of the table
+TASKS_COLUMNS = (
+    "user TEXT,"
+    "id TEXT,"
+    "action_at TIMESTAMP,"
+    "action TEXT,"
+    "UNIQUE (user, id, action)"
+)
+TASKS_TABLE = "CREATE TABLE IF NOT EXISTS {name} (" + TASKS_COLUMNS + ")"
+# since migration 4 the actions are ordered by a sequence
+TASKS_SEQ_TABLE = (
+    "CREATE TABLE {name} (seq INTEGER PRIMARY KEY AUTOINCREMENT," + TASKS_COLUMNS + ")"
+)
+# counting vetoes/help and finding pending tasks filter by user and action
+TASKS_USER_ACTION_INDEX = (
+    "CREATE INDEX IF NOT EXISTS tasks_user_action ON tasks (user, action, id)"
+)
+
+
+def _create_tasks_table(cursor):
+    cursor.execute(TASKS_TABLE.format(name="tasks"))
+
+
+def _drop_hash_key(cursor):
+    """
+    Databases created before the migrations enforce uniqueness through a
+    generated hash column CONCAT(user,id,action), which is ambiguous
+    ("ab" + "c" vs "a" + "bc"). We rebuild those with a composite key.
+    """
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(tasks)")]
+    if "hash" not in columns:
+        return
+    cursor.execute(TASKS_TABLE.format(name="tasks_new"))
+    cursor.execute(
+        "INSERT OR IGNORE INTO tasks_new (user, id, action_at, action) "
+        "SELECT user, id, action_at, action FROM tasks ORDER BY rowid"
+    )
+    cursor.execute("DROP TABLE tasks")
+    cursor.execute("ALTER TABLE tasks_new RENAME TO tasks")
+
+
+def _add_indexes(cursor):
+    cursor.execute(TASKS_USER_ACTION_INDEX)
+    # the latest action of a task and the list of action times filter by user and id
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS tasks_user_id_time "
+        "ON tasks (user, id, action_at, action)"
+    )
+
+
+def _add_sequence(cursor):
+    """
+    action_at only has a resolution of seconds, so actions written within the
+    same second cannot be ordered by it. We rebuild the table with a
+    monotonically increasing sequence, keeping the order of existing rows.
+    """
+    cursor.execute(TASKS_SEQ_TABLE.format(name="tasks_new"))
+    cursor.execute(
+        "INSERT INTO tasks_new (user, id, action_at, action) "
+        "SELECT user, id, action_at, action FROM tasks ORDER BY action_at, rowid"
+    )
+    cursor.execute("DROP TABLE tasks")
+    cursor.execute("ALTER TABLE tasks_new RENAME TO tasks")
+    # the indexes went with the old table
+    cursor.execute(TASKS_USER_ACTION_INDEX)
+    # the latest action of a task and the list of action times filter by user and id
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS tasks_user_id_seq "
+        "ON tasks (user, id, seq, action, action_at)"
+    )
+
+
+def rebuild_state(cursor):
+    """
+    Compute user_state and task_state from the whole action log again.
+    """
+    cursor.execute("DELETE FROM user_state")
+    cursor.execute("DELETE FROM task_state")
+    cursor.execute(
+        "INSERT INTO user_state (user, vetoes, help_shown, pending_id) "
+        "SELECT a.user, SUM(a.action = 'veto'), MAX(a.action = 'help'), "
+        "    (SELECT s.id FROM tasks s "
+        "     WHERE s.user = a.user AND s.action = 'show' AND s.id NOT IN ("
+        "         SELECT id FROM tasks WHERE user = a.user AND action IN ('done', 'veto')) "
+        "     ORDER BY s.seq LIMIT 1) "
+        "FROM tasks a GROUP BY a.user"
+    )
+    cursor.execute(
+        "INSERT INTO task_state (user, id, action, action_at, seq) "
+        "SELECT user, id, action, action_at, seq FROM tasks "
+        "WHERE seq IN (SELECT MAX(seq) FROM tasks GROUP BY user, id)"
+    )
+
+
+def _add_state_tables(cursor):
+    """
+    The lookups done on every request read a summary per user and per task,
+    which the trigger keeps up to date on every insert into the action log.
+    """
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS user_state ("
+        "user TEXT PRIMARY KEY,"
+        "vetoes INTEGER NOT NULL DEFAULT 0,"
+        "help_shown INTEGER NOT NULL DEFAULT 0,"
+        "pending_id TEXT)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS task_state ("
+        "user TEXT,"
+        "id TEXT,"
+        "action TEXT,"
+        "action_at TIMESTAMP,"
+        "seq INTEGER,"
+        "PRIMARY KEY (user, id))"
+    )
+    # a shown task is pending until it is done or vetoed; when the pending
+    # task is finished, the next unfinished shown task (if any) becomes pending
+    cursor.execute(
+        "CREATE TRIGGER IF NOT EXISTS tasks_update_state AFTER INSERT ON tasks "
+        "BEGIN "
+        "    INSERT INTO user_state (user) VALUES (NEW.user) "
+        "    ON CONFLICT (user) DO NOTHING; "
+        "    UPDATE user_state SET "
+        "        vetoes = vetoes + (NEW.action = 'veto'), "
+        "        help_shown = help_shown OR NEW.action = 'help', "
+        "        pending_id = CASE "
+        "            WHEN NEW.action IN ('done', 'veto') AND pending_id = NEW.id THEN ("
+        "                SELECT s.id FROM tasks s "
+        "                WHERE s.user = NEW.user AND s.action = 'show' AND s.id NOT IN ("
+        "                    SELECT id FROM tasks "
+        "                    WHERE user = NEW.user AND action IN ('done', 'veto')) "
+        "                ORDER BY s.seq LIMIT 1) "
+        "            WHEN NEW.action = 'show' AND pending_id IS NULL AND NOT EXISTS ("
+        "                SELECT 1 FROM tasks "
+        "                WHERE user = NEW.user AND id = NEW.id AND action IN ('done', 'veto')) "
+        "            THEN NEW.id "
+        "            ELSE pending_id END "
+        "    WHERE user = NEW.user; "
+        "    INSERT INTO task_state (user, id, action, action_at, seq) "
+        "    VALUES (NEW.user, NEW.id, NEW.action, NEW.action_at, NEW.seq) "
+        "    ON CONFLICT (user, id) DO UPDATE SET "
+        "        action = excluded.action, "
+        "        action_at = excluded.action_at, "
+        "        seq = excluded.seq; "
+        "END"
+    )
+    rebuild_state(cursor)
+
+
+def _add_outbox(cursor):
+    """
+    Notifications are written to the outbox in the same transaction as the
+    action they report, and delivered from there (see outbox.py).
+    """
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS outbox ("
+        "msg_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        "recipient TEXT NOT NULL,"
+        "subject TEXT,"
+        "body TEXT,"
+        "status TEXT NOT NULL DEFAULT 'pending',"
+        "attempts INTEGER NOT NULL DEFAULT 0,"
+        "next_attempt_at REAL NOT NULL DEFAULT 0,"
+        "last_error TEXT,"
+        "created_at TIMESTAMP,"
+        "sent_at TIMESTAMP)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)"
+    )
+
+
+MIGRATIONS = [
+    (1, "create action table", _create_tasks_table),
+    (2, "replace generated hash by composite unique key", _drop_hash_key),
+    (3, "add indexes for lookups by user", _add_indexes),
+    (4, "order actions by a sequence", _add_sequence),
+    (5, "add state summary maintained by triggers", _add_state_tables),
+    (6, "add notification outbox", _add_outbox),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+_initialised = set()
+_initialised_lock = threading.Lock()
+
+
+def get_version(conn):
+    """
+    Return the latest migration applied to the database, 0 for a new one.
+    """
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn):
+    """
+    Apply all pending migrations, each in its own transaction.
+    """
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY,"
+        "description TEXT,"
+        "applied_at TIMESTAMP)"
+    )
+    conn.commit()
+    for version, description, migration in MIGRATIONS:
+        if version <= get_version(conn):
+            continue
+        # we take the write lock first, so concurrent processes migrate one after another
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= get_version(conn):
+                conn.rollback()
+                continue
+            cursor = conn.cursor()
+            migration(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description, applied_at) "
+                "VALUES (?, ?, datetime('now'))",
+                (version, description),
+            )
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    return get_version(conn)
+
+
+def ensure_schema(db_name):
+    """
+    Migrate the given database file, once per process.
+    """
+    path = os.path.abspath(db_name)
+    if path in _initialised:
+        return
+    with _initialised_lock:
+        if path in _initialised:
+            return
+        conn = sqlite3.connect(db_name)
+        try:
+            migrate(conn)
+        finally:
+            conn.close()
+        _initialised.add(path)
+
+
+def forget(db_name):
+    """
+    Make ensure_schema() check the given database file again, e.g. after
+    it was deleted.
+    """
+    with _initialised_lock:
+        _initialised.discard(os.path.abspath(db_name))
+
+
+def rebuild(db_name):
+    """
+    Bring the database up to date and rebuild the state summary.
+    """
+    conn = sqlite3.connect(db_name)
+    try:
+        migrate(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        rebuild_state(conn.cursor())
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def main(argv):
+    # usage: python schema.py rebuild-state [database file]
+    if len(argv) < 2 or argv[1] != "rebuild-state":
+        print("usage: python schema.py rebuild-state [database file]")
+        return 1
+    db_name = argv[2] if len(argv) > 2 else "tasks.db"
+    rebuild(db_name)
+    print(f"Rebuilt the state summary of {db_name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,331 +1,584 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
-from string import Template
+from urllib.parse import unquote
 
-import pprint
-from markdown_it import MarkdownIt
+import argparse
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
 
+import app
 import config
+import db
+import notify
+import outbox
+import prefork
+import qrcache
 import tasks
-import qrcode
 
 LISTENING_PORT = 9000
 
+# defaults of the threaded mode, see also the "server" section of config.json
+WORKERS = 8
+MAX_PENDING = 64
+REQUEST_TIMEOUT = 30
+# seconds a kept-alive connection may wait for its next request
+IDLE_TIMEOUT = 5
+
 
 class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Serve the WSGI application in app.py over HTTP.
+
+    Responses are sent in one write, with their exact length. Servers that
+    handle connections concurrently set an idle_timeout attribute: their
+    connections are kept alive (HTTP/1.1) for up to idle_timeout seconds
+    between requests. Otherwise every connection is closed after its
+    response, as an idle connection would block a single-threaded server.
+
+    A server with a park() method watches idle connections itself: the
+    handler then returns after a response with keep_open set, instead of
+    waiting for the next request, and the server calls resume() once it
+    arrives.
+    """
+
+    application = staticmethod(app.application)
+    protocol_version = "HTTP/1.1"
+    idle_timeout = 0
+    keep_open = False
+    # we send headers and body together, so Nagle's algorithm would only delay them
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.idle_timeout = getattr(self.server, "idle_timeout", self.idle_timeout)
+
+    def handle(self):
+        request_timeout = self.connection.gettimeout()
+        parks = hasattr(self.server, "park")
+        self.handle_one_request()
+        while not self.close_connection:
+            if parks and not self._request_arrived():
+                # the server watches the idle connection, the worker is free for others
+                self.keep_open = True
+                return
+            if not self._wait_for_request():
+                break
+            self.connection.settimeout(request_timeout)
+            self.handle_one_request()
 
-    def _show_page(self, task, template):
+    def resume(self):
         """
-        create the page to show for an action on a task
+        Answer the requests arriving on a kept-open connection.
         """
-        # we initialize the markdown parser
-        md = MarkdownIt()
-        template = open(f"templates/{template}").read()
-        # in case the when field is a list, we create multiple lines
-        if isinstance(task["when"], list):
-            task["when"] = "\n".join(task["when"])
-        # we render the when field as markdown
-        task["when"] = md.render(task["when"])
-        if isinstance(task["description"], list):
-            task["description"] = "\n".join(task["description"])
-        task["description"] = md.render(task["description"])
-        task["remaining_vetoes"] = tasks.get_remaining_vetoes(task["user"])
-        task["used_vetoes"] = config.read_config()["vetoes"] - task["remaining_vetoes"]
-        if task["remaining_vetoes"] == 0:
-            task["remaining_vetoes"] = "keinen"
-        if task["used_vetoes"] == 0:
-            task["used_vetoes"] = "keinen"
-        # we get the task status to display it
-        task["status"] = tasks.get_task_status(task)
-        response = Template(template).substitute(task).encode("utf-8")
-        self.wfile.write(response)
-
-    def _veto_task(self, user, id, task):
+        self.keep_open = False
+        try:
+            self.handle()
+        finally:
+            self.finish()
+
+    def finish(self):
+        if self.keep_open:
+            # the connection stays open, only the response has to be sent
+            self.wfile.flush()
+            return
+        super().finish()
+
+    def _request_arrived(self):
         """
-        Prepare data and display web page for vetoing a task.
+        Tell whether the next request is there already, without waiting.
         """
+        timeout = self.connection.gettimeout()
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(timeout)
 
-        self.send_response(200)
-        self.end_headers()
-        # depending on success or failure, we show a different page
-        if not tasks.veto_task(user, id):
-            self._show_page(task, "task_veto_fail.tpl")
-        else:
-            self._show_page(task, "task_veto.tpl")
-        return
+    def _wait_for_request(self):
+        """
+        Wait up to idle_timeout seconds for the next request on the connection.
+        """
+        self.connection.settimeout(self.idle_timeout)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
 
-    def _do_task(self, user, id, task):
+    def environ(self):
         """
-        Prepare data and display web page for vetoing a task.
+        Build the WSGI environ of the current request.
         """
-        self.send_response(200)
+        path, _, query = self.path.partition("?")
+        environ = {
+            "REQUEST_METHOD": self.command,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote(path, "iso-8859-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": self.server.server_name,
+            "SERVER_PORT": str(self.server.server_port),
+            "SERVER_PROTOCOL": self.request_version,
+            "REMOTE_ADDR": self.client_address[0],
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": self.rfile,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in self.headers.items():
+            key = name.upper().replace("-", "_")
+            if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                key = "HTTP_" + key
+            environ[key] = value
+        return environ
+
+    def do_GET(self):
+        response = {}
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = status
+            response["headers"] = headers
+            return chunks.append
+
+        result = self.application(self.environ(), start_response)
+        try:
+            chunks.extend(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        body = b"".join(chunks)
+        code, _, reason = response["status"].partition(" ")
+        self.send_response(int(code), reason)
+        names = set()
+        for name, value in response["headers"]:
+            names.add(name.lower())
+            self.send_header(name, value)
+        if "content-length" not in names and int(code) not in (204, 304):
+            self.send_header("Content-Length", str(len(body)))
+        if not self.idle_timeout:
+            self.send_header("Connection", "close")
+        # the client may send its next request as soon as it has the answer
+        release_slot = getattr(self.server, "release_slot", None)
+        if release_slot is not None:
+            release_slot()
         self.end_headers()
-        tasks.do_task(user=user, id=id)
-        self._show_page(task, "task_done.tpl")
+        self.wfile.write(body)
 
-        return
+    def log_message(self, format, *args):
+        pass
 
-    def _show_task(self, user, id, task):
-        """
-        Prepare data and display web page for showing a task.
-        """
-        result = tasks.show_task(
-            user=user,
-            id=id,
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTP server handling requests on a bounded pool of worker threads.
+
+    Connections waiting for their first or next request are watched by one
+    selector thread, so idle clients do not hold a worker; a connection is
+    handed to the pool only once its request arrives. At most max_pending
+    requests wait for a free worker; further ones are answered with 503 at
+    once instead of piling up. Reading from and writing to a client gives
+    up after request_timeout seconds, so a slow client cannot hold a worker
+    forever. A new connection is closed after request_timeout seconds
+    without a request, a kept-alive one after idle_timeout seconds.
+    """
+
+    def __init__(
+        self,
+        server_address,
+        handler_class,
+        workers=WORKERS,
+        max_pending=MAX_PENDING,
+        request_timeout=REQUEST_TIMEOUT,
+        idle_timeout=IDLE_TIMEOUT,
+    ):
+        super().__init__(server_address, handler_class)
+        self.request_timeout = request_timeout
+        self.idle_timeout = idle_timeout
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="http-worker"
         )
-        self.send_response(200)
-        self.end_headers()
-        if result["id"] != task["id"]:
-            result["user"] = user
-            result["token"] = task["token"]
-            self._show_page(result, "task_show_pending.tpl")
-        elif result["id"] == task["id"]:
-            task_status = tasks.get_task_status(task)
-            if task_status == "Abgelehnt":
-                self._show_page(task, "task_show_vetoed.tpl")
-            elif task_status == "Erledigt":
-                self._show_page(task, "task_show_done.tpl")
-            else:
-                if tasks.get_remaining_vetoes(user) == 0:
-                    self._show_page(task, "task_show_no_vetoes.tpl")
-                else:
-                    self._show_page(task, "task_show.tpl")
-        else:
-            self._show_page(result, "task_show_not_found.tpl")
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        # whether the current worker thread still holds its slot
+        self._worker = threading.local()
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.handled = 0
+        self.rejected = 0
+        # connections to watch, handed over by the accepting and worker threads
+        self._parking = []
+        self._closing = False
+        self._selector = selectors.DefaultSelector()
+        self._wakeup, self._wakeup_sender = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._wakeup_sender.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+        self._watcher = threading.Thread(
+            target=self._watch, name="http-idle", daemon=True
+        )
+        self._watcher.start()
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        request.settimeout(self.request_timeout)
+        self.park(request, client_address)
 
-    def _help(self, user, id, task):
+    def park(self, request, client_address, handler=None):
         """
-        Show the help text in the template tasks_help.tpl
+        Watch the connection until its next request arrives. handler is the
+        RequestHandler of a kept-alive connection, None for a new one.
         """
-        tasks.store_help(user=user, task=task)
-        self.send_response(200)
-        self.end_headers()
-        self._show_page(task, "tasks_help.tpl")
+        timeout = self.request_timeout if handler is None else self.idle_timeout
+        with self._lock:
+            if not self._closing:
+                deadline = time.monotonic() + timeout
+                self._parking.append((request, client_address, handler, deadline))
+                request = None
+        if request is not None:
+            self._close(request, handler)
+            return
+        self._wake_watcher()
 
-    def _list_vouchers(self, user, token, task_list, url):
-        """
-        Get the list of vouchers for a user.
+    def _wake_watcher(self):
+        try:
+            self._wakeup_sender.send(b"\0")
+        except BlockingIOError:
+            # the watcher has not read the earlier wake-ups yet, it sees this one too
+            pass
+
+    def _watch(self):
+        while True:
+            events = self._selector.select(self._next_timeout())
+            for key, _ in events:
+                if key.fileobj is self._wakeup:
+                    if not self._take_parked():
+                        self._close_parked()
+                        return
+                    continue
+                self._selector.unregister(key.fileobj)
+                self._dispatch(key.fileobj, *key.data[:2])
+            self._expire()
+
+    def _take_parked(self):
         """
-        self.send_response(200)
-        self.end_headers()
-        content = {}
-        protocol = "http://"
-        table_content = """"
-        <table>
-        <tr>
-            <th>Title</th>
-            <th>QR-Code</th>
-            <th>Link</th>
-        </tr>
+        Start watching the connections parked since the last round; returns
+        False once the server is closing.
         """
-        for idx, task in enumerate(task_list):
-            title = task["title"]
-            task_url = protocol + url + f"/tasks/show?id={idx}&token={token}"
-            img_url = protocol + url + f"/tasks/qrcode?token={token}&url={task_url}"
-            help_url = protocol + url + f"/tasks/help?id={idx}&token={token}"
-            help_img_url = (
-                protocol + url + f"/tasks/qrcode?token={token}&url={help_url}"
-            )
-            table_row = """<tr>
-                <td>Aufgabe: {title}</td>
-                <td>Scan mich!</td>
-                <td><a href="{task_url}"><img src="{img_url}" alt="QR Code" height="50" width="50"/></a></td>
-                <td>Scan hier für die Erklärung des Spiels</td>
-                <td><a href="{help_url}"><img src="{help_img_url}" alt="QR Code" height="50" width="50"/></a></td>
-            </tr>
-            """
-            table_content += table_row.format(
-                title=title,
-                task_url=task_url,
-                img_url=img_url,
-                help_img_url=help_img_url,
-                help_url=help_url,
+        try:
+            while self._wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            parked, self._parking = self._parking, []
+            closing = self._closing
+        for request, client_address, handler, deadline in parked:
+            self._selector.register(
+                request, selectors.EVENT_READ, (client_address, handler, deadline)
             )
+        return not closing
 
-        table_content += """
-        </table>
-        """
-        content["table_content"] = table_content
-        content["user"] = user
-        content["token"] = token
-        response = (
-            Template(open("templates/task_vouchers.tpl").read())
-            .substitute(content)
-            .encode("utf-8")
-        )
-        self.wfile.write(response)
-        return
+    def _watched(self):
+        return [
+            key
+            for key in self._selector.get_map().values()
+            if key.fileobj is not self._wakeup
+        ]
 
-    def do_GET(self):
-        parsed_url = urlparse(self.path)
-        path_parts = parsed_url.path.strip("/").split("/")
-        query_params = parse_qs(parsed_url.query)
-        # we extract the full URL for display purposes
-        url = ""
-        for h in self.headers._headers:
-            if h[0] == "Host":
-                url = h[1]
-
-        if not path_parts or not path_parts[0]:
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(b"Module name required")
-            return
+    def _next_timeout(self):
+        deadlines = [key.data[2] for key in self._watched()]
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
 
-        module_name = path_parts[path_parts.index("tasks") + 1]
+    def _expire(self):
+        now = time.monotonic()
+        for key in self._watched():
+            client_address, handler, deadline = key.data
+            if deadline <= now:
+                self._selector.unregister(key.fileobj)
+                self._close(key.fileobj, handler)
 
-        if "token" not in query_params:
-            self.send_response(403)
-            self.end_headers()
-            self.wfile.write(b"Token required")
-            return
-        token = query_params["token"][0]
-        cfg = config.read_config()
-        user = config.get_user_from_token(cfg, token)
-        if not user:
-            self.send_response(403)
-            self.end_headers()
-            self.wfile.write(b"Invalid token")
+    def _close_parked(self):
+        for key in self._watched():
+            self._selector.unregister(key.fileobj)
+            self._close(key.fileobj, key.data[1])
+        with self._lock:
+            parked, self._parking = self._parking, []
+        for request, client_address, handler, deadline in parked:
+            self._close(request, handler)
+
+    def _dispatch(self, request, client_address, handler):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            self._reject(request)
+            self._close(request, handler)
             return
+        self.executor.submit(self._process, request, client_address, handler)
 
-        id = None
-        task = {}
-
-        # having a user, we can load the task list
-        task_list = tasks.list_tasks(user=user)
-        # if we want to show, do or veto a task, we need to load it first
-        if "id" in query_params:
-            id = int(query_params["id"][0])
-            if id >= len(task_list):
-                self.send_response(200)
-                self.end_headers()
-                pending = tasks.get_pending_task(user)
-                if pending is not None:
-                    pending["token"] = token
-                    pending["user"] = user
-                    self._show_page(pending, "task_not_found_pending.tpl")
-                    return
-                else:
-                    self._show_page(
-                        {"token": token, "user": user}, "task_not_found.tpl"
-                    )
-                    return
-            task = task_list[id]
-            task["token"] = token
-            task["user"] = user
-            task["index"] = id
-
-        if module_name == "debug":
-            if self.protocol_version == "HTTP/1.1":
-                protocol = "http://"
+    def _process(self, request, client_address, handler=None):
+        self._worker.slot = True
+        try:
+            if handler is None:
+                handler = self.RequestHandlerClass(request, client_address, self)
             else:
-                protocol = "https://"
-            self.send_response(200)
-            self.end_headers()
-            all_task_list = tasks.list_all_tasks()
-            content = {
-                "protocol": self.protocol_version,
-                "url": protocol + url,
-                "server": self.server.server_name + ":" + str(self.server.server_port),
-                "request_path": self.path,
-                "request_data": "<pre>" + pprint.pformat(query_params) + "</pre>",
-                "task_data": "<pre>" + pprint.pformat(all_task_list) + "</pre>",
-                "config_data": "<pre>" + pprint.pformat(cfg) + "</pre>",
-            }
-            response = (
-                Template(open("templates/task_debug.tpl").read())
-                .substitute(content)
-                .encode("utf-8")
-            )
-            self.wfile.write(response)
-            return
-        elif module_name == "voucher":
-            self._list_vouchers(user=user, token=token, task_list=task_list, url=url)
-            return
-        elif module_name == "qrcode":
-            self.send_response(200)
-            self.send_header("Content-type", "image/png")
-            self.end_headers()
-            qr_url = query_params.get("url", [""])[0]
-            if not qr_url:
-                self.wfile.write(b"URL parameter required")
-                return
-            qr_url += f"&token={token}"
-            qr = qrcode.QRCode()
-            qr.add_data(qr_url)
-            qr.make()
-            img = qr.make_image()
-            img.save(self.wfile, format="PNG")
-            return
-        elif module_name == "list":
-            self.send_response(200)
-            self.end_headers()
-            content = {}
-            # starting the table
-            tablecontent = """
-            <table>
-            <tr>
-                <th>ID</th>
-                <th>Description</th>
-                <th>When</th>
-                <th>Shown</th>
-                <th>Done</th>
-                <th>Vetoed</th>
-            </tr>
-            """
-            for task in task_list:
-                if isinstance(task["when"], list):
-                    task["when"] = "\n".join(task["when"])
-                if isinstance(task["description"], list):
-                    task["description"] = "\n".join(task["description"])
-                tablecontent += f"""
-                <tr>
-                    <td>{task["id"]}</td>
-                    <td>{task["description"]}</td>
-                    <td>{task["when"]}</td>
-                    <td>{task.get("shown_at", "N/A")}</td>
-                    <td>{task.get("done_at", "N/A")}</td>
-                    <td>{task.get("vetoed_at", "N/A")}</td>
-                </tr>
-                """
-            # finalize the table
-            tablecontent += """
-            </table>
-            """
-            content["task_table"] = tablecontent
-            response = (
-                Template(open("templates/task_list.tpl").read())
-                .substitute(content)
-                .encode("utf-8")
+                handler.resume()
+        except Exception:
+            self.handle_error(request, client_address)
+            if handler is not None:
+                handler.keep_open = False
+        finally:
+            self.release_slot()
+            with self._lock:
+                self.handled += 1
+        if handler is not None and handler.keep_open:
+            self.park(request, client_address, handler)
+        else:
+            self._close(request, handler)
+
+    def _close(self, request, handler=None):
+        if handler is not None:
+            handler.keep_open = False
+            handler.finish()
+        self.shutdown_request(request)
+
+    def release_slot(self):
+        """
+        Give the slot of the current worker back. The handler calls this
+        before it sends a response, so a client answering at once does not
+        find the worker still taken while the connection is closed.
+        """
+        if getattr(self._worker, "slot", False):
+            self._worker.slot = False
+            self._slots.release()
+
+    def _reject(self, request):
+        body = b"Server busy, please retry"
+        try:
+            request.settimeout(1)
+            request.sendall(
+                b"HTTP/1.0 503 Service Unavailable\r\n"
+                b"Content-Type: text/plain; charset=utf-8\r\n"
+                b"Retry-After: 1\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                b"Connection: close\r\n\r\n" + body
             )
-            self.wfile.write(response)
-            return
+            # closing with an unread request would reset the connection before
+            # the client has read the answer
+            request.settimeout(0)
+            while request.recv(65536):
+                pass
+        except OSError:
+            pass
 
-        help_needed = not tasks.get_help_status(user=user)
+    def server_close(self):
+        super().server_close()
+        with self._lock:
+            self._closing = True
+        self._wake_watcher()
+        self._watcher.join()
+        # we let the requests already accepted finish; their connections are closed
+        self.executor.shutdown(wait=True)
+        self._selector.close()
+        self._wakeup.close()
+        self._wakeup_sender.close()
 
-        if help_needed or module_name == "help":
-            self._help(user=user, id=id, task=task)
-        elif module_name == "show":
-            self._show_task(user=user, id=id, task=task)
-            return
-        elif module_name == "do":
-            self._do_task(user=user, id=id, task=task)
-            return
-        elif module_name == "veto":
-            self._veto_task(user=user, id=id, task=task)
-            return
-        else:
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write(b"Module not found")
-            return
+    def stats(self):
+        with self._lock:
+            return {
+                "connections": self.connections,
+                "handled": self.handled,
+                "rejected": self.rejected,
+            }
 
-    def log_message(self, format, *args):
-        pass
+
+class ReusePortHTTPServer(PooledHTTPServer):
+    """
+    Threaded server whose listening socket is shared with the other worker
+    processes of the prefork mode through SO_REUSEPORT.
+    """
+
+    allow_reuse_port = True
+
+
+def server_settings():
+    try:
+        return config.read_config().get("server", {})
+    except FileNotFoundError:
+        return {}
+
+
+def make_server(mode, port, workers, max_pending, request_timeout, idle_timeout):
+    """
+    Create the HTTP server for the given mode ("single", "threaded" or
+    "prefork"; the latter is the server of one worker process).
+    """
+    server_address = ("", port)
+    if mode in ("threaded", "prefork"):
+        server_class = ReusePortHTTPServer if mode == "prefork" else PooledHTTPServer
+        return server_class(
+            server_address,
+            RequestHandler,
+            workers=workers,
+            max_pending=max_pending,
+            request_timeout=request_timeout,
+            idle_timeout=idle_timeout,
+        )
+    return HTTPServer(server_address, RequestHandler)
+
+
+def add_startup_arguments(parser, settings):
+    """
+    Add the options of startup(), shared by all entry points.
+    """
+    parser.add_argument(
+        "--reload-templates",
+        action="store_true",
+        default=settings.get("reload_templates", False),
+        help="development mode: pick up changed templates without a restart",
+    )
+    parser.add_argument(
+        "--prerender",
+        action="store_true",
+        default=settings.get("prerender_markdown", False),
+        help="render the markdown of the whole catalog before serving",
+    )
+
+
+def startup(args):
+    """
+    Prepare the application and the database once, before serving (and
+    before forking the worker processes).
+    """
+    # a missing or malformed template stops us here, not in the middle of a request
+    app.startup(reload_templates=args.reload_templates, prerender=args.prerender)
+    # we bring the database up to date once, before serving any request
+    tasks.create_db()
+
+
+def shutdown():
+    """
+    Stop the background work of a serving process.
+    """
+    # we deliver the notifications still waiting in the queue
+    outbox.shutdown()
+    notify.shutdown()
+    qrcache.shutdown()
+    db.close_connections()
+
+
+@contextmanager
+def serving():
+    """
+    Run the background work of a serving process while the block runs,
+    and shut it down cleanly at its end.
+    """
+    # notifications left in the outbox by an earlier run are delivered now
+    outbox.get_worker(tasks.DB_NAME)
+    try:
+        yield
+    finally:
+        shutdown()
+
+
+def parse_args(argv=None):
+    settings = server_settings()
+    parser = argparse.ArgumentParser(description="Serve the tasks pages.")
+    parser.add_argument(
+        "--mode",
+        choices=("single", "threaded", "prefork"),
+        default=settings.get("mode", "single"),
+        help="handle one request at a time, several on a pool of threads, "
+        "or several on a pool of threads in each of several processes",
+    )
+    parser.add_argument(
+        "--port", type=int, default=settings.get("port", LISTENING_PORT)
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.get("workers", WORKERS),
+        help="number of worker threads in threaded and prefork mode",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=settings.get("processes", prefork.PROCESSES),
+        help="number of worker processes in prefork mode",
+    )
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=settings.get("max_pending", MAX_PENDING),
+        help="requests waiting for a worker before new ones get a 503",
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        default=settings.get("request_timeout", REQUEST_TIMEOUT),
+        help="seconds to wait for a client to send or receive data",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=settings.get("idle_timeout", IDLE_TIMEOUT),
+        help="seconds to keep an idle connection open for the next request",
+    )
+    add_startup_arguments(parser, settings)
+    return parser.parse_args(argv)
+
+
+def serve(httpd):
+    """
+    Serve requests until interrupted or terminated, then shut down cleanly.
+    """
+
+    def terminate(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it needs a thread of its own
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, terminate)
+    with serving():
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    startup(args)
+
+    def server():
+        return make_server(
+            args.mode,
+            args.port,
+            args.workers,
+            args.max_pending,
+            args.request_timeout,
+            args.idle_timeout,
+        )
+
+    if args.mode == "prefork":
+        print(f"Starting {args.processes} server processes on port {args.port}...")
+        prefork.Supervisor(lambda slot: serve(server()), processes=args.processes).run()
+        return
+    print(f"Starting server on port {args.port} ({args.mode})...")
+    serve(server())
 
 
 if __name__ == "__main__":
-    server_address = ("", LISTENING_PORT)
-    httpd = HTTPServer(server_address, RequestHandler)
-    print(f"Starting server on port {LISTENING_PORT}...")
-    httpd.serve_forever()
+    main()
@@ -0,0 +1,72 @@
+"""
+Module to coalesce concurrent identical work.
+
+When several threads ask for the same key at the same time, the first one
+computes the result and the others wait for it and share it, instead of
+doing the same expensive work in parallel. Results are not kept once the
+work is done; caching is left to the caller.
+"""
+
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Run a function at most once at a time per key.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.followers = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        """
+        Return function(), or the result of the call for key already running.
+        An error of the running call is raised in all waiting threads.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if leader:
+            return self._lead(key, call, function)
+        return self._follow(call)
+
+    def _lead(self, key, call, function):
+        try:
+            call.result = function()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _follow(self, call):
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "running": len(self._calls),
+            }
@@ -1,17 +1,27 @@
 # main module of the tasks application
 
-import json
-import sqlite3
-
 import os
 import sys
-import time
 
+import catalog
 import config
-import notify
+import db
+import outbox
+import schema
 
 DB_NAME = "tasks.db"
 
+# one aggregated pass over the actions of a user, pivoting the actions into columns
+LIST_TASKS_QUERY = (
+    "SELECT id, "
+    "    MAX(CASE action WHEN 'show' THEN action_at END) AS shown_at, "
+    "    MAX(CASE action WHEN 'veto' THEN action_at END) AS vetoed_at, "
+    "    MAX(CASE action WHEN 'done' THEN action_at END) AS done_at "
+    "FROM tasks "
+    "WHERE user = ? "
+    "GROUP BY id"
+)
+
 task_status = {
     None: "Nicht gefunden",
     "help": "Hilfeseite",
@@ -22,155 +32,158 @@ task_status = {
 }
 
 
-def list_all_tasks():
+def list_all_tasks(db_name=DB_NAME, uow=None):
     """
     We return a list of all tasks for all users.
     """
     cfg = config.read_config()
     task_list = {}
     for user in cfg["users"]:
-        task_list[user] = list_tasks(user=user)
+        task_list[user] = list_tasks(user=user, db_name=db_name, uow=uow)
     return task_list
 
 
-def list_tasks(user="default_user"):
+def _get_action_times(user, db_name=DB_NAME, uow=None):
+    """
+    We return the times of the relevant actions of the user, by task id.
+    """
+
+    def load():
+        with db.connection(db_name, uow) as conn:
+            cursor = conn.cursor()
+            # we ask for the time of each relevant action, one row per task
+            cursor.execute(LIST_TASKS_QUERY, (user,))
+            rows = cursor.fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    return db.cached_read(db_name, uow, ("action_times", user), load)
+
+
+def _enrich(task, action_times):
+    # we join the rows to the task by its id
+    times = action_times.get(task["id"])
+    if times is not None:
+        task["shown_at"], task["vetoed_at"], task["done_at"] = times
+    return task
+
+
+def list_tasks(user="default_user", db_name=DB_NAME, uow=None):
     """
     We return a list of all tasks for the given user, enriched with
     their status from the database.
     """
-    tasks = json.load(open("tasks.json"))
-    task_list = tasks[user]["tasks"]
+    task_list = catalog.get_tasks(user)
     # now we need to enrich the tasks with information from the database
-    create_db()
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    # we ask for all tasks with their actions
-    cursor.execute(
-        (
-            "select distinct"
-            "	t_main.id, "
-            "	(select action_at from tasks where id = t_main.id and user = t_main.user and action = 'show') as shown_at, "
-            "	(select action_at from tasks where id = t_main.id and user = t_main.user and action = 'veto') as vetoed_at, "
-            "	(select action_at from tasks where id = t_main.id and user = t_main.user and action = 'done') as done_at "
-            "from "
-            "	tasks t_main "
-            "where "
-            "	user = ?;"
-        ),
-        (user,),
-    )
-    rows = cursor.fetchall()
-    conn.close()
-    for row in rows:
-        task_id = row[0]
-        shown_at = row[1]
-        vetoed_at = row[2]
-        done_at = row[3]
-        # we find the task in the task_list by its id
-        for task in task_list:
-            if task["id"] == task_id:
-                task["shown_at"] = shown_at
-                task["vetoed_at"] = vetoed_at
-                task["done_at"] = done_at
-                break
+    action_times = _get_action_times(user, db_name=db_name, uow=uow)
+    return [_enrich(task, action_times) for task in task_list]
 
-    return task_list
+
+def get_task(user, idx, db_name=DB_NAME, uow=None):
+    """
+    We return the task at position idx for the given user, enriched with
+    its status from the database. Only this task is copied from the catalog.
+    """
+    task = catalog.get_task(user, idx)
+    return _enrich(task, _get_action_times(user, db_name=db_name, uow=uow))
 
 
 def create_db(db_name=DB_NAME):
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    sql_cmd = (
-        "CREATE TABLE IF NOT EXISTS tasks ("
-        "user TEXT,"
-        "id TEXT,"
-        "action_at TIMESTAMP,"
-        "action TEXT,"
-        "hash TEXT GENERATED ALWAYS AS (CONCAT(user,id,action)) STORED UNIQUE)"
-    )
-    cursor.execute(sql_cmd)
-    conn.commit()
-    conn.close()
-
-
-def get_help_status(user, db_name=DB_NAME):
+    """
+    Create the database, or bring an existing one up to the latest layout.
+    This is done once per database file and process, at startup.
+    """
+    schema.ensure_schema(db_name)
+
+
+def _notify(user, subject, body, db_name=DB_NAME, uow=None):
+    """
+    Write a notification about the user to the outbox. It is part of the
+    caller's transaction and delivered once the transaction is committed.
+    """
+    notification_email = config.read_config()["users"][user]["notify_email"]
+    with db.connection(db_name, uow) as conn:
+        outbox.add(conn, notification_email, subject=subject, body=body)
+    db.after_commit(db_name, uow, lambda: outbox.wake(db_name))
+
+
+def get_help_status(user, db_name=DB_NAME, uow=None):
     """
     return True in case the help for the given user has been shown already
     """
-    create_db(db_name=db_name)
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    cursor.execute(
-        ("SELECT COUNT(*) " "FROM tasks " "WHERE user = ? AND action = 'help'"),
-        (user,),
-    )
-    row = cursor.fetchone()
-    conn.close()
-    help_shown = row[0] if row else 0
-    return help_shown > 0
-
-
-def store_help(user, task, db_name=DB_NAME):
+
+    def load():
+        with db.connection(db_name, uow) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT help_shown FROM user_state WHERE user = ?",
+                (user,),
+            )
+            row = cursor.fetchone()
+        help_shown = row[0] if row else 0
+        return help_shown > 0
+
+    return db.cached_read(db_name, uow, ("help", user), load)
+
+
+def store_help(user, task, db_name=DB_NAME, uow=None):
     """
     Store the time stamp of the help-display
     """
-    if not task:
-        task["id"] = "dummy"
-        task["title"] = "Dummy Title"
-    set_task_status(task=task, status="help", user=user, db_name=db_name)
-    notification_email = config.read_config()["users"][user]["notify_email"]
-    notify.send_notification_email(
-        notification_email,
-        subject="Help shown Notification",
-        body=f"{user} has shown the help page on task: {task['title']}",
-    )
+    # the action and its notification are written in one transaction
+    with db.transaction(db_name, uow) as uow:
+        if not task:
+            task["id"] = "dummy"
+            task["title"] = "Dummy Title"
+        set_task_status(task=task, status="help", user=user, db_name=db_name, uow=uow)
+        _notify(
+            user,
+            subject="Help shown Notification",
+            body=f"{user} has shown the help page on task: {task['title']}",
+            db_name=db_name,
+            uow=uow,
+        )
 
 
-def get_remaining_vetoes(user, db_name=DB_NAME):
-    create_db(db_name=db_name)
+def get_remaining_vetoes(user, db_name=DB_NAME, uow=None):
     cfg = config.read_config()
     max_vetoes = cfg["vetoes"]
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    cursor.execute(
-        ("SELECT COUNT(*) " "FROM tasks " "WHERE user = ? AND action = 'veto'"),
-        (user,),
-    )
-    row = cursor.fetchone()
-    conn.close()
-    used_vetoes = row[0] if row else 0
+
+    def load():
+        with db.connection(db_name, uow) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT vetoes FROM user_state WHERE user = ?",
+                (user,),
+            )
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+    used_vetoes = db.cached_read(db_name, uow, ("vetoes", user), load)
     return max_vetoes - used_vetoes
 
 
-def get_pending_task(user, db_name=DB_NAME):
-    create_db(db_name=db_name)
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    cursor.execute(
-        (
-            "SELECT id "
-            "FROM tasks "
-            "WHERE user = ? AND action = 'show' "
-            "AND id NOT IN ("
-            "    SELECT id"
-            "    FROM tasks"
-            "    WHERE user = ? AND action IN ('done', 'veto'))"
-        ),
-        (user, user),
-    )
-    row = cursor.fetchone()
-    conn.close()
-    if row:
-        task_id = row[0]
-        task_list = list_tasks(user=user)
-        for idx, task in enumerate(task_list):
-            if task["id"] == task_id:
-                task["index"] = idx
-                return task
+def get_pending_task(user, db_name=DB_NAME, uow=None):
+
+    def load():
+        with db.connection(db_name, uow) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT pending_id FROM user_state WHERE user = ?",
+                (user,),
+            )
+            return cursor.fetchone()
+
+    row = db.cached_read(db_name, uow, ("pending", user), load)
+    if row and row[0] is not None:
+        idx = catalog.index_of(user, row[0])
+        if idx is not None:
+            task = get_task(user, idx, db_name=db_name, uow=uow)
+            task["index"] = idx
+            return task
     return None
 
 
-def get_task_status(task, user=None, db_name=DB_NAME):
+def get_task_status(task, user=None, db_name=DB_NAME, uow=None):
     """
     Get status of task for given user.
     This depends on the latest action taken on the task.
@@ -180,21 +193,17 @@ def get_task_status(task, user=None, db_name=DB_NAME):
     """
     if user is None:
         user = task["user"]
-    create_db(db_name=db_name)
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    cursor.execute(
-        (
-            "SELECT action_at, action "
-            "FROM tasks "
-            "WHERE user = ? AND id = ? "
-            "ORDER BY action_at DESC "
-            "LIMIT 1"
-        ),
-        (user, task["id"]),
-    )
-    row = cursor.fetchone()
-    conn.close()
+
+    def load():
+        with db.connection(db_name, uow) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT action_at, action FROM task_state WHERE user = ? AND id = ?",
+                (user, task["id"]),
+            )
+            return cursor.fetchone()
+
+    row = db.cached_read(db_name, uow, ("status", user, task["id"]), load)
     # if we found an action, we return its status
     if row:
         return task_status[row[1]]
@@ -202,7 +211,7 @@ def get_task_status(task, user=None, db_name=DB_NAME):
     return task_status[None]
 
 
-def set_task_status(task, status, user=None, db_name=DB_NAME):
+def set_task_status(task, status, user=None, db_name=DB_NAME, uow=None):
     """
     Set status of task for given user.
 
@@ -210,105 +219,111 @@ def set_task_status(task, status, user=None, db_name=DB_NAME):
     :param task: Beschreibung
     :param status: Beschreibung
     """
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    # we allow only to insert an action once per task
-    try:
+    with db.connection(db_name, uow) as conn:
+        cursor = conn.cursor()
+        # an action is stored once per task; repeating it is no error, any
+        # other failure of the write ends the whole unit of work
         cursor.execute(
             (
                 "INSERT INTO tasks "
                 "(user, id, action_at, action) "
-                "VALUES (?, ?, datetime('now'), ?)"
+                "VALUES (?, ?, datetime('now'), ?) "
+                "ON CONFLICT (user, id, action) DO NOTHING"
             ),
             (user, task["id"], status),
         )
-    except sqlite3.IntegrityError:
-        print(
-            f"Task {task['id']} was already set to {status} before, not inserting again."
-        )
-    conn.commit()
-    conn.close()
+        if cursor.rowcount == 0:
+            print(
+                f"Task {task['id']} was already set to {status} before, not inserting again."
+            )
+    # the remembered reads of the unit of work are outdated now
+    db.changed(db_name, uow)
 
 
-def show_task(user, id, db_name=DB_NAME):
+def show_task(user, id, db_name=DB_NAME, uow=None):
     """
     We show the given task from the database.
 
     :param id: Beschreibung
     """
-    create_db(db_name=db_name)
-    tasks = list_tasks(user=user)
-    notification_email = config.read_config()["users"][user]["notify_email"]
-    task = tasks[id]
-    task_status = get_task_status(task, user=user, db_name=db_name)
-    # in case the task is not done or vetoed, we need to check for pending tasks
-    if task_status not in ["Erledigt", "Abgelehnt"]:
-        pending_task = get_pending_task(user, db_name=db_name)
-        if pending_task is not None and pending_task != task["id"]:
-            notify.send_notification_email(
-                notification_email,
-                subject="Task found Notification",
-                body=(
-                    f"{user} has found {task['title']} but cannot work on it yet, because {pending_task['title']} "
-                    "has not been done or vetoed yet."
-                ),
-            )
-            set_task_status(task, "found", user=user, db_name=db_name)
-            return pending_task
-    print(f"Showing task: {task['title']}")
-    # we set the task to found and show, so that we can track that the user is working on it
-    set_task_status(task, "found", user=user, db_name=db_name)
-    time.sleep(1)  # we wait a bit to have a different timestamp for the show action
-    set_task_status(task, "show", user=user, db_name=db_name)
-    notify.send_notification_email(
-        notification_email,
-        subject="Task shown Notification",
-        body=f"{user} is now working on task: {task['title']}",
-    )
-    return task
+    # the action and its notification are written in one transaction
+    with db.transaction(db_name, uow) as uow:
+        task = get_task(user, id, db_name=db_name, uow=uow)
+        task_status = get_task_status(task, user=user, db_name=db_name, uow=uow)
+        # in case the task is not done or vetoed, we need to check for pending tasks
+        if task_status not in ["Erledigt", "Abgelehnt"]:
+            pending_task = get_pending_task(user, db_name=db_name, uow=uow)
+            if pending_task is not None and pending_task != task["id"]:
+                set_task_status(task, "found", user=user, db_name=db_name, uow=uow)
+                _notify(
+                    user,
+                    subject="Task found Notification",
+                    body=(
+                        f"{user} has found {task['title']} but cannot work on it yet, because {pending_task['title']} "
+                        "has not been done or vetoed yet."
+                    ),
+                    db_name=db_name,
+                    uow=uow,
+                )
+                return pending_task
+        print(f"Showing task: {task['title']}")
+        # we set the task to found and show, so that we can track that the user is working on it;
+        # both are written in one transaction and ordered by their sequence
+        set_task_status(task, "found", user=user, db_name=db_name, uow=uow)
+        set_task_status(task, "show", user=user, db_name=db_name, uow=uow)
+        _notify(
+            user,
+            subject="Task shown Notification",
+            body=f"{user} is now working on task: {task['title']}",
+            db_name=db_name,
+            uow=uow,
+        )
+        return task
 
 
-def do_task(user, id, db_name=DB_NAME):
+def do_task(user, id, db_name=DB_NAME, uow=None):
     """
     We mark the given task as done in the database.
 
     :param id: Beschreibung
     """
-    notification_email = config.read_config()["users"][user]["notify_email"]
-    create_db(db_name=db_name)
-    tasks = list_tasks(user=user)
-    task = tasks[id]
-    print(f"Doing task: {task['title']}")
-    set_task_status(task, "done", user=user, db_name=db_name)
-    notify.send_notification_email(
-        notification_email,
-        subject="Task done Notification",
-        body=f"{user} has marked task {task['title']} as done.",
-    )
+    # the action and its notification are written in one transaction
+    with db.transaction(db_name, uow) as uow:
+        task = get_task(user, id, db_name=db_name, uow=uow)
+        print(f"Doing task: {task['title']}")
+        set_task_status(task, "done", user=user, db_name=db_name, uow=uow)
+        _notify(
+            user,
+            subject="Task done Notification",
+            body=f"{user} has marked task {task['title']} as done.",
+            db_name=db_name,
+            uow=uow,
+        )
 
 
-def veto_task(user, id, db_name=DB_NAME):
+def veto_task(user, id, db_name=DB_NAME, uow=None):
     """
     We mark the given task as vetoed in the database.
 
     :param id: Beschreibung
     """
-    create_db(db_name=db_name)
-    notification_email = config.read_config()["users"][user]["notify_email"]
-    tasks = list_tasks(user=user)
-    task = tasks[id]
-    # we need to check if we have remaining vetoes
-    remaining_vetoes = get_remaining_vetoes(user, db_name=db_name)
-    if remaining_vetoes <= 0:
-        return False
-    print(f"Vetoing task: {task['title']}")
-    set_task_status(task, "veto", user=user, db_name=db_name)
-    notify.send_notification_email(
-        notification_email,
-        subject="Task vetoed Notification",
-        body=f"{user} has vetoed task {task['title']}",
-    )
-    return True
+    # the action and its notification are written in one transaction
+    with db.transaction(db_name, uow) as uow:
+        task = get_task(user, id, db_name=db_name, uow=uow)
+        # we need to check if we have remaining vetoes
+        remaining_vetoes = get_remaining_vetoes(user, db_name=db_name, uow=uow)
+        if remaining_vetoes <= 0:
+            return False
+        print(f"Vetoing task: {task['title']}")
+        set_task_status(task, "veto", user=user, db_name=db_name, uow=uow)
+        _notify(
+            user,
+            subject="Task vetoed Notification",
+            body=f"{user} has vetoed task {task['title']}",
+            db_name=db_name,
+            uow=uow,
+        )
+        return True
 
 
 def main(argv):
@@ -317,6 +332,8 @@ def main(argv):
     except FileNotFoundError:
         print("test.db not found, continuing")
         pass
+    schema.forget("test.db")
+    create_db(db_name="test.db")
     print("argv:", argv)
     # we pick data from command line for testing
     token = argv[1]
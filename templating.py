@@ -0,0 +1,178 @@
+"""
+Module to encapsulate the page templates (templates/*.tpl).
+
+All templates are read and compiled once, when the server starts, so a
+missing or malformed template stops the server at boot instead of failing
+a request later. In development mode (reload=True) every lookup checks the
+file on disk and compiles it again after a change.
+
+The markdown of the task fields is rendered by one shared parser, and the
+HTML is kept in a bounded cache keyed by the hash of the source text.
+"""
+
+import glob
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from string import Template
+
+from markdown_it import MarkdownIt
+
+import config
+
+TEMPLATE_DIR = "templates"
+MARKDOWN_CACHE_SIZE = 1024
+
+
+class TemplateError(Exception):
+    """
+    A template is missing or cannot be compiled.
+    """
+
+
+def compile_template(path):
+    """
+    Read and compile a single template file.
+    """
+    with open(path, encoding="utf-8") as template_file:
+        template = Template(template_file.read())
+    if not template.is_valid():
+        raise TemplateError(f"{path}: invalid placeholder")
+    return template
+
+
+class TemplateRegistry:
+    """
+    Process-wide cache of the compiled templates.
+    """
+
+    def __init__(self, directory=TEMPLATE_DIR, reload=False):
+        self.directory = directory
+        self.reload = reload
+        self.hits = 0
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._templates = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _compile(self, name):
+        path = self._path(name)
+        signature = config.file_signature(path)
+        return signature, compile_template(path)
+
+    def load(self, required=()):
+        """
+        Compile all templates of the directory. Raise a TemplateError naming
+        every template that is malformed, or required but missing.
+        """
+        templates = {}
+        errors = {}
+        for path in sorted(glob.glob(self._path("*.tpl"))):
+            name = os.path.basename(path)
+            try:
+                templates[name] = self._compile(name)
+            except (OSError, UnicodeDecodeError, TemplateError) as error:
+                errors[name] = str(error)
+        for name in required:
+            if name not in templates and name not in errors:
+                errors[name] = f"{self._path(name)}: missing"
+        if errors:
+            raise TemplateError("; ".join(errors.values()))
+        with self._lock:
+            self._templates = templates
+            self.reloads += 1
+        return sorted(templates)
+
+    def get(self, name):
+        """
+        Return the compiled template of the given name.
+        """
+        if self._templates is None:
+            self.load()
+        with self._lock:
+            entry = self._templates.get(name)
+            if entry is not None and not self.reload:
+                self.hits += 1
+                return entry[1]
+        if not self.reload:
+            raise TemplateError(f"{self._path(name)}: missing")
+        try:
+            signature = config.file_signature(self._path(name))
+        except FileNotFoundError:
+            raise TemplateError(f"{self._path(name)}: missing") from None
+        if entry is not None and entry[0] == signature:
+            with self._lock:
+                self.hits += 1
+            return entry[1]
+        entry = self._compile(name)
+        with self._lock:
+            self._templates[name] = entry
+            self.reloads += 1
+        return entry[1]
+
+    def render(self, name, mapping):
+        """
+        Fill the template with mapping and return the page as UTF-8.
+        """
+        return self.get(name).substitute(mapping).encode("utf-8")
+
+    def stats(self):
+        return {"hits": self.hits, "reloads": self.reloads}
+
+
+class MarkdownCache:
+    """
+    Bounded (least recently used) cache of rendered markdown.
+    """
+
+    def __init__(self, size=MARKDOWN_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._md = MarkdownIt()
+        self._lock = threading.Lock()
+        self._rendered = OrderedDict()
+
+    def render(self, text):
+        """
+        Return the HTML of the markdown text; a list is rendered line by line.
+        """
+        if isinstance(text, (list, tuple)):
+            text = "\n".join(text)
+        key = hashlib.sha256(text.encode("utf-8")).digest()
+        with self._lock:
+            html = self._rendered.get(key)
+            if html is not None:
+                self._rendered.move_to_end(key)
+                self.hits += 1
+                return html
+        html = self._md.render(text)
+        with self._lock:
+            self.misses += 1
+            self._rendered[key] = html
+            if len(self._rendered) > self.size:
+                self._rendered.popitem(last=False)
+        return html
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._rendered),
+            }
+
+
+registry = TemplateRegistry()
+markdown = MarkdownCache()
+
+
+def render(name, mapping):
+    return registry.render(name, mapping)
+
+
+def render_markdown(text):
+    return markdown.render(text)
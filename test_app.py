@@ -0,0 +1,148 @@
+"""
+Pytest-based test module for the WSGI application, called without a server.
+"""
+
+import json
+import os
+from unittest.mock import patch
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+
+import app
+import db
+import qrcache
+import templating
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """A directory with config, tasks and templates, used as working directory."""
+    config_data = {
+        "vetoes": 1,
+        "users": {"default_user": {"token": "42", "notify_email": "test@test.org"}},
+    }
+    tasks_data = {
+        "default_user": {
+            "tasks": [
+                {"id": "task-1", "title": "One", "when": "now", "description": "x"},
+            ]
+        }
+    }
+    (tmp_path / "config.json").write_text(json.dumps(config_data))
+    (tmp_path / "tasks.json").write_text(json.dumps(tasks_data))
+    (tmp_path / "templates").symlink_to(TEMPLATES)
+    monkeypatch.chdir(tmp_path)
+    with patch("outbox.wake"):
+        yield tmp_path
+    db.close_connections()
+
+
+def call(path, query="", headers=None):
+    environ = {"PATH_INFO": path, "QUERY_STRING": query, **(headers or {})}
+    setup_testing_defaults(environ)
+    response = {}
+
+    def start_response(status, headers):
+        response["status"] = status
+        response["headers"] = dict(headers)
+
+    body = b"".join(app.application(environ, start_response))
+    return response["status"], response["headers"], body
+
+
+class TestStartup:
+    """Test the checks done before serving."""
+
+    def test_all_templates_present(self, workspace):
+        app.startup()
+
+    def test_prerender(self, workspace):
+        """The markdown of the whole catalog is rendered into the cache."""
+        assert app.prerender_markdown() == 2
+        before = templating.markdown.stats()["hits"]
+        call("/tasks/help", "token=42&id=0")
+        assert templating.markdown.stats()["hits"] == before + 2
+
+    def test_missing_template(self, tmp_path, monkeypatch):
+        (tmp_path / "templates").mkdir()
+        monkeypatch.chdir(tmp_path)
+        with pytest.raises(templating.TemplateError, match="task_show.tpl: missing"):
+            app.startup()
+
+
+class TestApplication:
+    """Test the routing of the application."""
+
+    def test_token_required(self, workspace):
+        status, _, body = call("/tasks/list")
+        assert status == "403 Forbidden"
+        assert body == b"Token required"
+
+    def test_list(self, workspace):
+        status, _, body = call("/tasks/list", "token=42")
+        assert status == "200 OK"
+        assert b"task-1" in body
+
+    def test_show_flow(self, workspace):
+        """The first request shows the help, the next one the task."""
+        assert b"Wie es funktioniert" in call("/tasks/show", "token=42&id=0")[2]
+        status, _, body = call("/tasks/show", "token=42&id=0")
+        assert status == "200 OK"
+        assert b"Wie es funktioniert" not in body
+        assert b"<h1>One</h1>" in body
+
+    def test_show_nonexistent_task_without_pending(self, workspace):
+        """An unknown task id is answered with a page, also with no task pending."""
+        status, _, body = call("/tasks/show", "token=42&id=999")
+        assert status == "200 OK"
+        assert b"Hinweis" in body
+
+    def test_qrcode(self, workspace):
+        status, headers, body = call("/tasks/qrcode", "token=42&url=http://x/")
+        assert status == "200 OK"
+        assert headers["Content-Type"] == "image/png"
+        assert body.startswith(b"\x89PNG")
+
+    def test_qrcode_without_database(self, workspace):
+        """A QR code is answered without a transaction or the task list."""
+        with patch("db.get_connection", side_effect=AssertionError("database")):
+            with patch("tasks.list_tasks", side_effect=AssertionError("tasks")):
+                status, _, _ = call("/tasks/qrcode", "token=42&url=http://y/")
+        assert status == "200 OK"
+
+    def test_qrcode_not_modified(self, workspace):
+        """A client that has the image gets a 304 without a body."""
+        _, headers, _ = call("/tasks/qrcode", "token=42&url=http://x/")
+        assert "immutable" in headers["Cache-Control"]
+        environ = {"HTTP_IF_NONE_MATCH": headers["ETag"]}
+        status, headers, body = call("/tasks/qrcode", "token=42&url=http://x/", environ)
+        assert status == "304 Not Modified"
+        assert body == b""
+        assert "Content-Length" not in headers
+
+    def test_qrcode_not_modified_without_image(self, workspace):
+        """A matching If-None-Match is answered before the image is looked up."""
+        etag = qrcache.make_etag("http://x/&token=42")
+        environ = {"HTTP_IF_NONE_MATCH": etag}
+        with patch("qrcache.get_png", side_effect=AssertionError("image")):
+            status, headers, _ = call(
+                "/tasks/qrcode", "token=42&url=http://x/", environ
+            )
+        assert status == "304 Not Modified"
+        assert headers["ETag"] == etag
+
+    def test_inline_vouchers(self, workspace):
+        """The voucher sheet embeds its QR codes instead of linking them."""
+        status, _, body = call("/tasks/voucher", "token=42&inline=1")
+        assert status == "200 OK"
+        assert body.count(b'src="data:image/png;base64,') == 2
+        assert b"/tasks/qrcode" not in body
+
+    def test_unknown_module(self, workspace):
+        call("/tasks/help", "token=42&id=0")
+        status, _, body = call("/tasks/nonexistent", "token=42")
+        assert status == "404 Not Found"
+        assert body == b"Module not found"
@@ -0,0 +1,82 @@
+"""
+Pytest-based test module for the task catalog.
+"""
+
+import json
+import os
+
+import pytest
+
+import catalog
+
+
+@pytest.fixture
+def tasks_file(tmp_path):
+    """Write a minimal tasks.json and return its path."""
+    path = tmp_path / "tasks.json"
+    path.write_text(
+        json.dumps(
+            {
+                "default_user": {
+                    "tasks": [
+                        {
+                            "id": "task-1",
+                            "title": "One",
+                            "when": "now",
+                            "description": "x",
+                        },
+                        {
+                            "id": "task-2",
+                            "title": "Two",
+                            "when": ["a", "b"],
+                            "description": ["c"],
+                        },
+                    ]
+                }
+            }
+        )
+    )
+    return path
+
+
+class TestTaskCatalog:
+    """Test caching and copying of the task catalog."""
+
+    def test_parses_once(self, tasks_file):
+        """Repeated reads of an unchanged file are served from the cache."""
+        task_catalog = catalog.TaskCatalog(str(tasks_file))
+        task_catalog.get_tasks("default_user")
+        task_catalog.get_tasks("default_user")
+        assert task_catalog.stats() == {"hits": 1, "reloads": 1}
+
+    def test_index_of(self, tasks_file):
+        """Task ids map to their position in the list."""
+        task_catalog = catalog.TaskCatalog(str(tasks_file))
+        assert task_catalog.index_of("default_user", "task-2") == 1
+        assert task_catalog.index_of("default_user", "missing") is None
+
+    def test_copies_do_not_change_catalog(self, tasks_file):
+        """Modifying a returned task leaves the catalog untouched."""
+        task_catalog = catalog.TaskCatalog(str(tasks_file))
+        task = task_catalog.get_tasks("default_user")[1]
+        task["when"].append("c")
+        task["token"] = "42"
+        fresh = task_catalog.get_task("default_user", 1)
+        assert fresh["when"] == ["a", "b"]
+        assert "token" not in fresh
+
+    def test_reloads_on_change(self, tasks_file):
+        """A changed file is parsed again on the next read."""
+        task_catalog = catalog.TaskCatalog(str(tasks_file))
+        assert len(task_catalog.get_tasks("default_user")) == 2
+        data = json.loads(tasks_file.read_text())
+        data["default_user"]["tasks"].pop()
+        tasks_file.write_text(json.dumps(data))
+        stat = os.stat(tasks_file)
+        os.utime(tasks_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        assert len(task_catalog.get_tasks("default_user")) == 1
+
+    def test_unknown_user(self, tasks_file):
+        """Asking for a user without tasks raises KeyError, like before."""
+        with pytest.raises(KeyError):
+            catalog.TaskCatalog(str(tasks_file)).get_tasks("nobody")
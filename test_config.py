@@ -0,0 +1,116 @@
+"""
+Pytest-based test module for the configuration store.
+"""
+
+import json
+import os
+
+import pytest
+
+import config
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    """Write a minimal config.json and return its path."""
+    path = tmp_path / "config.json"
+    path.write_text(
+        json.dumps(
+            {
+                "vetoes": 2,
+                "users": {
+                    "default_user": {"token": "42", "notify_email": "a@test.org"},
+                    "lovedone": {"token": "12345678", "notify_email": "b@test.org"},
+                },
+            }
+        )
+    )
+    return path
+
+
+class TestConfigStore:
+    """Test caching and reloading of config.json."""
+
+    def test_parses_once(self, config_file):
+        """Repeated reads of an unchanged file are served from the cache."""
+        store = config.ConfigStore(str(config_file))
+        first = store.get()
+        second = store.get()
+        assert first is second
+        assert store.hits == 1
+        assert store.reloads == 1
+
+    def test_reloads_on_change(self, config_file):
+        """A changed file is parsed again on the next read."""
+        store = config.ConfigStore(str(config_file))
+        assert store.get()["vetoes"] == 2
+        data = json.loads(config_file.read_text())
+        data["vetoes"] = 10
+        config_file.write_text(json.dumps(data))
+        stat = os.stat(config_file)
+        os.utime(config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        assert store.get()["vetoes"] == 10
+        assert store.reloads == 2
+
+    def test_explicit_reload(self, config_file):
+        """reload() parses the file even if it did not change."""
+        store = config.ConfigStore(str(config_file))
+        store.get()
+        store.reload()
+        assert store.reloads == 2
+
+    def test_snapshot_is_immutable(self, config_file):
+        """The snapshot cannot be modified by callers."""
+        snapshot = config.ConfigStore(str(config_file)).get()
+        with pytest.raises(TypeError):
+            snapshot["vetoes"] = 5
+        with pytest.raises(TypeError):
+            snapshot["users"]["default_user"]["token"] = "0"
+
+    def test_thaw_returns_plain_copy(self, config_file):
+        """thaw() gives back plain dicts that can be modified."""
+        plain = config.thaw(config.ConfigStore(str(config_file)).get())
+        plain["vetoes"] = 5
+        assert isinstance(plain["users"], dict)
+
+
+class TestTokenIndex:
+    """Test resolving tokens to users."""
+
+    def test_known_tokens(self, config_file):
+        """Every configured token resolves to its user."""
+        store = config.ConfigStore(str(config_file))
+        cfg = store.get()
+        assert store.lookup_token(cfg, "42") == "default_user"
+        assert store.lookup_token(cfg, "12345678") == "lovedone"
+
+    def test_unknown_token_is_cached(self, config_file):
+        """An unknown token is answered from the negative cache the second time."""
+        store = config.ConfigStore(str(config_file))
+        cfg = store.get()
+        assert store.lookup_token(cfg, "invalid") is None
+        assert store.lookup_token(cfg, "invalid") is None
+        assert store.negative_hits == 1
+
+    def test_negative_cache_is_bounded(self, config_file):
+        """The negative cache never grows beyond its size."""
+        store = config.ConfigStore(str(config_file), negative_cache_size=3)
+        cfg = store.get()
+        for token in range(10):
+            store.lookup_token(cfg, f"bad-{token}")
+        assert store.stats()["unknown_tokens"] == 3
+
+    def test_reload_clears_negative_cache(self, config_file):
+        """A token added to config.json is found after the reload."""
+        store = config.ConfigStore(str(config_file))
+        assert store.lookup_token(store.get(), "new") is None
+        data = json.loads(config_file.read_text())
+        data["users"]["newbie"] = {"token": "new", "notify_email": "c@test.org"}
+        config_file.write_text(json.dumps(data))
+        assert store.lookup_token(store.reload(), "new") == "newbie"
+
+    def test_plain_dict_config(self):
+        """get_user_from_token still accepts a plain configuration dict."""
+        cfg = {"users": {"someone": {"token": "abc"}}}
+        assert config.get_user_from_token(cfg, "abc") == "someone"
+        assert config.get_user_from_token(cfg, "abd") is None
@@ -0,0 +1,105 @@
+"""
+Pytest-based test module for the pooled database connections.
+"""
+
+import threading
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def db_name(tmp_path):
+    name = str(tmp_path / "tasks.db")
+    yield name
+    db.close_connections()
+
+
+class TestConnections:
+    """Test the per-thread connection pool."""
+
+    def test_connection_is_reused(self, db_name):
+        """The same thread gets the same connection back."""
+        assert db.get_connection(db_name) is db.get_connection(db_name)
+
+    def test_connection_per_thread(self, db_name):
+        """Another thread gets a connection of its own."""
+        connections = []
+        thread = threading.Thread(
+            target=lambda: connections.append(db.get_connection(db_name))
+        )
+        thread.start()
+        thread.join()
+        assert connections[0] is not db.get_connection(db_name)
+
+    def test_pragmas(self, db_name):
+        """New connections use WAL, synchronous=NORMAL and a busy timeout."""
+        conn = db.get_connection(db_name)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == db.BUSY_TIMEOUT
+
+    def test_commit_and_rollback(self, db_name):
+        """A block is committed on success and rolled back on errors."""
+        with db.connection(db_name) as conn:
+            conn.execute(
+                "INSERT INTO tasks (user, id, action) VALUES ('u', 'a', 'show')"
+            )
+        with pytest.raises(RuntimeError):
+            with db.connection(db_name) as conn:
+                conn.execute(
+                    "INSERT INTO tasks (user, id, action) VALUES ('u', 'b', 'show')"
+                )
+                raise RuntimeError("abort")
+        with db.connection(db_name) as conn:
+            ids = [row[0] for row in conn.execute("SELECT id FROM tasks")]
+        assert ids == ["a"]
+
+    def test_nested_unit_of_work(self, db_name, tmp_path):
+        """A nested unit of work restores the outer one when it ends."""
+        with db.UnitOfWork(db_name) as outer:
+            with db.UnitOfWork(str(tmp_path / "other.db")) as inner:
+                assert db.current_unit_of_work() is inner
+            assert db.current_unit_of_work() is outer
+        assert db.current_unit_of_work() is None
+
+    def test_other_file_does_not_join(self, db_name, tmp_path):
+        """A write to another file is not part of the open unit of work."""
+        other = str(tmp_path / "other.db")
+        with pytest.raises(RuntimeError):
+            with db.UnitOfWork(db_name, write=True):
+                with db.connection(other) as conn:
+                    conn.execute(
+                        "INSERT INTO tasks (user, id, action) VALUES ('u', 'a', 'show')"
+                    )
+                raise RuntimeError("abort")
+        with db.connection(other) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0] == 1
+        with db.connection(db_name) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0] == 0
+
+    def test_nested_unit_of_work_on_same_file(self, db_name):
+        """A second unit of work on the same file is refused clearly."""
+        with db.UnitOfWork(db_name) as outer:
+            with pytest.raises(RuntimeError, match="already open"):
+                with db.UnitOfWork(db_name):
+                    pass
+            assert db.current_unit_of_work() is outer
+
+    def test_failing_after_commit_callback(self, db_name):
+        """A failing callback neither fails the commit nor skips the others."""
+        called = []
+
+        def fail():
+            raise ValueError("broken")
+
+        with db.UnitOfWork(db_name, write=True) as uow:
+            uow.conn.execute(
+                "INSERT INTO tasks (user, id, action) VALUES ('u', 'a', 'show')"
+            )
+            db.after_commit(db_name, uow, fail)
+            db.after_commit(db_name, uow, lambda: called.append(True))
+        assert called == [True]
+        with db.connection(db_name) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0] == 1
@@ -0,0 +1,211 @@
+"""
+Pytest-based test module for sending notifications.
+"""
+
+import threading
+import time
+from email.message import EmailMessage
+from smtplib import SMTPRecipientsRefused, SMTPServerDisconnected
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import notify
+
+
+class TestNotificationDispatcher:
+    """Test the background delivery of notifications."""
+
+    def test_delivers_in_background(self):
+        """Enqueued notifications are sent by the workers."""
+        dispatcher = notify.NotificationDispatcher(workers=2)
+        with patch("notify.send_notification_email") as send:
+            dispatcher.start()
+            for number in range(5):
+                assert dispatcher.enqueue("a@test.org", f"subject {number}", "body")
+            assert dispatcher.shutdown(timeout=5)
+        assert send.call_count == 5
+        stats = dispatcher.stats()
+        assert stats["sent"] == 5
+        assert stats["queue_depth"] == 0
+
+    def test_enqueue_does_not_wait_for_delivery(self):
+        """A slow mail server does not block the caller."""
+        release = threading.Event()
+        dispatcher = notify.NotificationDispatcher(workers=1)
+        with patch(
+            "notify.send_notification_email",
+            side_effect=lambda *a, **k: release.wait(5),
+        ):
+            dispatcher.start()
+            assert dispatcher.enqueue("a@test.org", "subject", "body")
+            assert dispatcher.enqueue("a@test.org", "subject", "body")
+            assert dispatcher.stats()["sent"] == 0
+            release.set()
+            assert dispatcher.shutdown(timeout=5)
+        assert dispatcher.stats()["sent"] == 2
+
+    def test_failures_are_counted(self):
+        """A failing delivery does not stop the worker."""
+        dispatcher = notify.NotificationDispatcher(workers=1)
+        with patch("notify.send_notification_email", side_effect=OSError("down")):
+            dispatcher.start()
+            dispatcher.enqueue("a@test.org", "subject", "body")
+            dispatcher.enqueue("a@test.org", "subject", "body")
+            assert dispatcher.shutdown(timeout=5)
+        assert dispatcher.stats()["failed"] == 2
+
+    def test_full_queue_drops(self):
+        """Notifications beyond the queue size are dropped and counted."""
+        dispatcher = notify.NotificationDispatcher(workers=1, queue_size=2)
+        assert dispatcher.enqueue("a@test.org", "one", "body")
+        assert dispatcher.enqueue("a@test.org", "two", "body")
+        assert not dispatcher.enqueue("a@test.org", "three", "body")
+        assert dispatcher.stats()["dropped"] == 1
+
+
+SETTINGS = {
+    "from_address": "test@test.de",
+    "smtp_server": "mail.test.de",
+    "smtp_port": 25,
+    "smtp_username": "testuser",
+    "smtp_password": "testpass",
+}
+
+
+def make_message(number=0):
+    msg = EmailMessage()
+    msg["To"] = "a@test.org"
+    msg["Subject"] = f"subject {number}"
+    msg.set_content("body")
+    return msg
+
+
+class TestSMTPPool:
+    """Test reusing SMTP sessions."""
+
+    def test_session_is_reused(self):
+        """Several mails share one connect, STARTTLS and login."""
+        with patch("notify.SMTP") as smtp_class:
+            smtp_class.return_value.noop.return_value = (250, b"OK")
+            pool = notify.SMTPPool(SETTINGS)
+            for number in range(3):
+                pool.send(make_message(number))
+        assert smtp_class.call_count == 1
+        assert smtp_class.return_value.login.call_count == 1
+        assert smtp_class.return_value.send_message.call_count == 3
+        assert pool.reuses == 2
+
+    def test_dead_session_is_replaced(self):
+        """A session failing the NOOP check is closed and replaced."""
+        with patch("notify.SMTP") as smtp_class:
+            smtp_class.return_value.noop.side_effect = SMTPServerDisconnected()
+            pool = notify.SMTPPool(SETTINGS)
+            pool.send(make_message(1))
+            pool.send(make_message(2))
+        assert pool.connects == 2
+
+    def test_session_is_recycled(self):
+        """A session is closed after max_messages mails."""
+        with patch("notify.SMTP") as smtp_class:
+            smtp_class.return_value.noop.return_value = (250, b"OK")
+            pool = notify.SMTPPool(SETTINGS, max_messages=2)
+            for number in range(5):
+                pool.send(make_message(number))
+        assert pool.connects == 3
+
+    def test_reconnects_on_disconnect(self):
+        """A connection dropped while sending is re-opened transparently."""
+        with patch("notify.SMTP") as smtp_class:
+            first, second = MagicMock(), MagicMock()
+            first.noop.return_value = (250, b"OK")
+            first.send_message.side_effect = [None, SMTPServerDisconnected()]
+            smtp_class.side_effect = [first, second]
+            pool = notify.SMTPPool(SETTINGS)
+            pool.send(make_message(1))
+            pool.send(make_message(2))
+        second.send_message.assert_called_once()
+
+
+class TestDigest:
+    """Test combining notifications per recipient."""
+
+    def test_compose_digest(self):
+        """Several events become one mail listing all of them."""
+        subject, body = notify.compose_digest([("Done", "one"), ("Veto", "two")])
+        assert subject == "2 Task Notifications"
+        assert "Done:\none" in body and "Veto:\ntwo" in body
+        assert notify.compose_digest([("Done", "one")]) == ("Done", "one")
+
+    def test_one_mail_per_recipient(self):
+        """Notifications within the window are sent as one mail per recipient."""
+        dispatcher = notify.NotificationDispatcher(workers=1, digest_window=0.2)
+        with patch("notify.send_notification_email") as send:
+            dispatcher.start()
+            for number in range(3):
+                dispatcher.enqueue("a@test.org", f"subject {number}", "body")
+            dispatcher.enqueue("b@test.org", "subject", "body")
+            time.sleep(0.5)
+            assert send.call_count == 2
+            assert dispatcher.shutdown(timeout=5)
+        recipients = sorted(call.args[0] for call in send.call_args_list)
+        assert recipients == ["a@test.org", "b@test.org"]
+        assert dispatcher.stats()["digested"] == 4
+
+    def test_shutdown_flushes_digests(self):
+        """Collected notifications are sent at shutdown without waiting for the window."""
+        dispatcher = notify.NotificationDispatcher(workers=1, digest_window=60)
+        with patch("notify.send_notification_email") as send:
+            dispatcher.start()
+            dispatcher.enqueue("a@test.org", "one", "body")
+            dispatcher.enqueue("a@test.org", "two", "body")
+            assert dispatcher.shutdown(timeout=5)
+        send.assert_called_once()
+
+
+class TestCircuitBreaker:
+    """Test failing fast while the mail server is down."""
+
+    def test_opens_after_threshold(self):
+        """After threshold failures no more connections are attempted."""
+        with patch("notify.SMTP", side_effect=ConnectionRefusedError()) as smtp_class:
+            pool = notify.SMTPPool(
+                SETTINGS, breaker=notify.CircuitBreaker(threshold=2, cooldown=60)
+            )
+            for _ in range(2):
+                with pytest.raises(ConnectionRefusedError):
+                    pool.send(make_message())
+            with pytest.raises(notify.CircuitOpenError) as raised:
+                pool.send(make_message())
+        assert 0 < raised.value.retry_after <= 60
+        assert smtp_class.call_count == 2
+        assert pool.breaker.stats() == {"state": "open", "failures": 2, "rejected": 1}
+
+    def test_half_open_trial(self):
+        """After the cooldown one trial is let through and closes the breaker."""
+        breaker = notify.CircuitBreaker(threshold=1, cooldown=0.05)
+        breaker.failure()
+        assert not breaker.allow()
+        time.sleep(0.1)
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.success()
+        assert breaker.state == "closed"
+        assert breaker.allow()
+
+    def test_rejection_does_not_open(self):
+        """A refused recipient shows the server is up and does not count."""
+        with patch("notify.SMTP") as smtp_class:
+            smtp_class.return_value.send_message.side_effect = SMTPRecipientsRefused({})
+            pool = notify.SMTPPool(SETTINGS, breaker=notify.CircuitBreaker(threshold=1))
+            with pytest.raises(SMTPRecipientsRefused):
+                pool.send(make_message())
+        assert pool.breaker.state == "closed"
+
+    def test_timeouts(self):
+        """Sessions are opened with the connect timeout and use the read timeout."""
+        settings = dict(SETTINGS, connect_timeout=3, timeout=7)
+        with patch("notify.SMTP") as smtp_class:
+            notify.SMTPPool(settings).send(make_message())
+        assert smtp_class.call_args.kwargs["timeout"] == 3
+        smtp_class.return_value.sock.settimeout.assert_called_with(7)
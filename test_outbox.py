@@ -0,0 +1,125 @@
+"""
+Pytest-based test module for delivering notifications from the outbox.
+"""
+
+import time
+from unittest.mock import patch
+
+import pytest
+
+import db
+import notify
+import outbox
+
+
+@pytest.fixture
+def db_name(tmp_path):
+    name = str(tmp_path / "tasks.db")
+    yield name
+    db.close_connections()
+
+
+def add_rows(db_name, count):
+    with db.connection(db_name) as conn:
+        for number in range(count):
+            outbox.add(conn, "a@test.org", subject=f"subject {number}", body="body")
+
+
+def statuses(db_name):
+    with db.connection(db_name) as conn:
+        return conn.execute(
+            "SELECT status, attempts FROM outbox ORDER BY msg_id"
+        ).fetchall()
+
+
+def deliver(worker):
+    """Run one delivery round and wait for the dispatcher to finish it."""
+    worker.dispatcher = notify.NotificationDispatcher(workers=1)
+    worker.dispatcher.start()
+    count = worker.deliver_due()
+    assert worker.dispatcher.shutdown(timeout=5)
+    return count
+
+
+class TestOutboxWorker:
+    """Test the delivery of outbox rows."""
+
+    def test_rows_are_sent(self, db_name):
+        """Due rows are delivered and marked as sent."""
+        add_rows(db_name, 3)
+        worker = outbox.OutboxWorker(db_name)
+        with patch("notify.send_notification_email") as send:
+            assert deliver(worker) == 3
+        assert send.call_count == 3
+        assert statuses(db_name) == [("sent", 1)] * 3
+
+    def test_batch_size(self, db_name):
+        """A round claims at most batch_size rows."""
+        add_rows(db_name, 5)
+        worker = outbox.OutboxWorker(db_name, batch_size=2)
+        with patch("notify.send_notification_email"):
+            assert deliver(worker) == 2
+
+    def test_failure_is_retried_later(self, db_name):
+        """A failed row waits for its backoff before it is due again."""
+        add_rows(db_name, 1)
+        worker = outbox.OutboxWorker(db_name, retry_delay=60)
+        with patch("notify.send_notification_email", side_effect=OSError("down")):
+            deliver(worker)
+        assert statuses(db_name) == [("pending", 1)]
+        with patch("notify.send_notification_email"):
+            assert deliver(worker) == 0
+
+    def test_dead_letter(self, db_name):
+        """A row failing max_attempts times is given up."""
+        add_rows(db_name, 1)
+        worker = outbox.OutboxWorker(db_name, max_attempts=2, retry_delay=0)
+        with patch("notify.send_notification_email", side_effect=OSError("down")):
+            deliver(worker)
+            deliver(worker)
+            assert deliver(worker) == 0
+        assert statuses(db_name) == [("dead", 2)]
+
+    def test_expired_lease_is_claimed_again(self, db_name):
+        """A row claimed by a process that died is delivered after the lease."""
+        add_rows(db_name, 1)
+        assert len(outbox.OutboxWorker(db_name, lease=0).claim()) == 1
+        time.sleep(0.01)
+        with patch("notify.send_notification_email"):
+            assert deliver(outbox.OutboxWorker(db_name)) == 1
+        assert statuses(db_name) == [("sent", 1)]
+
+    def test_refused_rows_are_released(self, db_name):
+        """Rows the dispatcher refuses are pending again after a short delay."""
+        add_rows(db_name, 2)
+        worker = outbox.OutboxWorker(db_name, release_delay=60)
+        worker.dispatcher = notify.NotificationDispatcher(workers=1)
+        worker.dispatcher.shutdown(timeout=5)
+        assert worker.deliver_due() == 0
+        assert worker.refused == 2
+        assert statuses(db_name) == [("pending", 0)] * 2
+        assert worker.claim() == []
+
+    def test_open_breaker_is_no_attempt(self, db_name):
+        """A row meeting an open breaker waits for its cooldown, uncounted."""
+        add_rows(db_name, 1)
+        worker = outbox.OutboxWorker(db_name, retry_delay=0)
+        error = notify.CircuitOpenError("open", retry_after=60)
+        before = time.time()
+        with patch("notify.send_notification_email", side_effect=error):
+            assert deliver(worker) == 1
+        assert statuses(db_name) == [("pending", 0)]
+        with db.connection(db_name) as conn:
+            due = conn.execute("SELECT next_attempt_at FROM outbox").fetchone()[0]
+        assert due >= before + 60
+        assert worker.claim() == []
+
+    def test_lease_must_outlast_digest(self):
+        """A lease shorter than the digest window is rejected."""
+        outbox.check_lease(300, 60)
+        with pytest.raises(ValueError):
+            outbox.check_lease(60, 60)
+
+    def test_retry_delay_doubles(self):
+        """The backoff doubles with every attempt up to its limit."""
+        assert [outbox.retry_delay(n, 10, 50) for n in range(1, 5)] == [10, 20, 40, 50]
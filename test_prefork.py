@@ -0,0 +1,62 @@
+"""
+Pytest-based test module for the supervisor of the worker processes.
+"""
+
+import os
+import signal
+import threading
+import time
+
+import prefork
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+class TestSupervisor:
+    """Test starting, restarting and stopping worker processes."""
+
+    def test_restarts_crashed_worker(self, tmp_path):
+        """A worker that dies is replaced, until the supervisor is stopped."""
+        marker = tmp_path / "crashed"
+
+        def target(slot):
+            if slot == 0 and not marker.exists():
+                marker.write_text(str(os.getpid()))
+                os._exit(3)
+            signal.pause()
+
+        supervisor = prefork.Supervisor(target, processes=2, restart_delay=0)
+        thread = threading.Thread(target=supervisor.run, daemon=True)
+        thread.start()
+        try:
+            wait_for(lambda: supervisor.restarts == 1 and len(supervisor.workers) == 2)
+            assert sorted(supervisor.workers.values()) == [0, 1]
+        finally:
+            supervisor.stop()
+        thread.join(5)
+        assert not thread.is_alive()
+        assert supervisor.workers == {}
+
+    def test_kills_workers_ignoring_sigterm(self):
+        """Workers that do not stop within the timeout are killed."""
+
+        def target(slot):
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            while True:
+                time.sleep(1)
+
+        supervisor = prefork.Supervisor(target, processes=1, shutdown_timeout=0.2)
+        thread = threading.Thread(target=supervisor.run, daemon=True)
+        thread.start()
+        try:
+            wait_for(lambda: len(supervisor.workers) == 1)
+        finally:
+            supervisor.stop()
+        thread.join(5)
+        assert not thread.is_alive()
+        assert supervisor.restarts == 0
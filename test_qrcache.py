@@ -0,0 +1,82 @@
+"""
+Pytest-based test module for the QR code cache.
+"""
+
+from unittest.mock import patch
+
+import qrcache
+
+
+class TestQRCodeCache:
+    """Test caching of the generated QR codes in memory and on disk."""
+
+    def test_generates_once(self):
+        cache = qrcache.QRCodeCache()
+        png, etag = cache.get("http://x/tasks/show?id=0&token=42")
+        assert png.startswith(b"\x89PNG")
+        assert cache.get("http://x/tasks/show?id=0&token=42") == (png, etag)
+        assert cache.stats() == {"hits": 1, "disk_hits": 0, "misses": 1, "size": 1}
+
+    def test_etag_depends_on_text(self):
+        cache = qrcache.QRCodeCache()
+        assert cache.get("a")[1] != cache.get("b")[1]
+        assert cache.get("a")[1] == qrcache.make_etag("a")
+
+    def test_etag_depends_on_format_version(self):
+        etag = qrcache.make_etag("a")
+        with patch("qrcache.FORMAT_VERSION", qrcache.FORMAT_VERSION + 1):
+            assert qrcache.make_etag("a") != etag
+
+    def test_bounded(self):
+        cache = qrcache.QRCodeCache(size=1)
+        cache.get("a")
+        cache.get("b")
+        cache.get("a")
+        assert cache.stats()["misses"] == 3
+        assert cache.stats()["size"] == 1
+
+    def test_disk_cache_survives_restart(self, tmp_path):
+        directory = str(tmp_path / "qrcache")
+        png, etag = qrcache.QRCodeCache(directory=directory).get("a")
+        cache = qrcache.QRCodeCache(directory=directory)
+        assert cache.get("a") == (png, etag)
+        assert cache.stats() == {"hits": 0, "disk_hits": 1, "misses": 0, "size": 1}
+        assert not list((tmp_path / "qrcache").glob("*.tmp"))
+
+    def test_disk_errors_are_not_fatal(self, tmp_path):
+        """An image that cannot be written to disk is served from memory."""
+        cache = qrcache.QRCodeCache(directory=str(tmp_path))
+        with patch("tempfile.mkstemp", side_effect=OSError(28, "No space left")):
+            png, _ = cache.get("http://x/")
+        assert png.startswith(b"\x89PNG")
+        assert cache.get("http://x/")[0] == png
+        assert list(tmp_path.iterdir()) == []
+
+    def test_unreadable_disk_copy_is_rebuilt(self, tmp_path):
+        """A cached file that cannot be read is generated again."""
+        directory = str(tmp_path / "qrcache")
+        png, _ = qrcache.QRCodeCache(directory=directory).get("a")
+        cache = qrcache.QRCodeCache(directory=directory)
+        with patch("builtins.open", side_effect=PermissionError(13, "Denied")):
+            assert cache.get("a")[0] == png
+        assert cache.stats()["misses"] == 1
+
+    def test_get_many_deduplicates(self):
+        cache = qrcache.QRCodeCache(processes=0)
+        cache.get("a")
+        entries = cache.get_many(["a", "b", "b", "c"])
+        assert sorted(entries) == ["a", "b", "c"]
+        assert entries["b"] == cache.get("b")
+        # one for a, one each for b and c
+        assert cache.stats()["misses"] == 3
+
+    def test_get_many_in_parallel(self):
+        """Codes generated by the process pool equal those built in place."""
+        cache = qrcache.QRCodeCache(processes=2, parallel_threshold=2)
+        try:
+            entries = cache.get_many([f"link-{i}" for i in range(6)])
+        finally:
+            cache.close()
+        assert len(entries) == 6
+        assert entries["link-3"][0] == qrcache.make_png("link-3")
+        assert cache.stats()["misses"] == 6
@@ -0,0 +1,180 @@
+"""
+Pytest-based test module for the database layout and its migrations.
+"""
+
+import sqlite3
+from unittest.mock import patch
+
+import pytest
+
+import schema
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """A connection to a new, empty database file."""
+    connection = sqlite3.connect(tmp_path / "tasks.db")
+    yield connection
+    connection.close()
+
+
+def query_plan(conn, sql, params):
+    return " ".join(
+        row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)
+    )
+
+
+class TestMigrations:
+    """Test creating and upgrading the database."""
+
+    def test_new_database_gets_latest_version(self, conn):
+        """A new database runs all migrations."""
+        assert schema.migrate(conn) == schema.LATEST_VERSION
+        assert schema.get_version(conn) == schema.LATEST_VERSION
+
+    def test_migrate_is_idempotent(self, conn):
+        """Running the migrations twice does not apply them twice."""
+        schema.migrate(conn)
+        schema.migrate(conn)
+        count = conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0]
+        assert count == len(schema.MIGRATIONS)
+
+    def test_unique_key_is_not_ambiguous(self, conn):
+        """user "ab" with task "c" and user "a" with task "bc" do not collide."""
+        schema.migrate(conn)
+        conn.execute("INSERT INTO tasks (user, id, action) VALUES ('ab', 'c', 'show')")
+        conn.execute("INSERT INTO tasks (user, id, action) VALUES ('a', 'bc', 'show')")
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute(
+                "INSERT INTO tasks (user, id, action) VALUES ('a', 'bc', 'show')"
+            )
+
+    def test_legacy_database_is_migrated(self, conn):
+        """A database with the generated hash column keeps its rows."""
+        conn.execute(
+            "CREATE TABLE tasks (user TEXT, id TEXT, action_at TIMESTAMP, action TEXT,"
+            "hash TEXT GENERATED ALWAYS AS (user || id || action) STORED UNIQUE)"
+        )
+        conn.execute(
+            "INSERT INTO tasks (user, id, action_at, action) "
+            "VALUES ('u', 't', '2026-01-01 10:00:00', 'show')"
+        )
+        conn.commit()
+        schema.migrate(conn)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(tasks)")]
+        assert "hash" not in columns
+        rows = conn.execute("SELECT user, id, action_at, action FROM tasks").fetchall()
+        assert rows == [("u", "t", "2026-01-01 10:00:00", "show")]
+
+
+class TestIndexes:
+    """Test that the lookups by user do not scan the whole table."""
+
+    @pytest.mark.parametrize(
+        "sql, params",
+        [
+            ("SELECT COUNT(*) FROM tasks WHERE user = ? AND action = 'veto'", ("u",)),
+            (
+                "SELECT id FROM tasks WHERE user = ? AND action = 'show' AND id NOT IN "
+                "(SELECT id FROM tasks WHERE user = ? AND action IN ('done', 'veto'))",
+                ("u", "u"),
+            ),
+            (
+                "SELECT action_at, action FROM tasks WHERE user = ? AND id = ? "
+                "ORDER BY seq DESC LIMIT 1",
+                ("u", "t"),
+            ),
+        ],
+    )
+    def test_lookup_uses_covering_index(self, conn, sql, params):
+        schema.migrate(conn)
+        plan = query_plan(conn, sql, params)
+        assert "COVERING INDEX" in plan
+        assert "SCAN tasks" not in plan
+
+
+class TestEnsureSchema:
+    """Test the once-per-process schema initialisation."""
+
+    def test_migrates_once(self, tmp_path):
+        """A second call does not touch the database any more."""
+        db_name = str(tmp_path / "once.db")
+        schema.ensure_schema(db_name)
+        with patch("schema.migrate") as migrate:
+            schema.ensure_schema(db_name)
+        migrate.assert_not_called()
+
+    def test_forget(self, tmp_path):
+        """After forget() the database is checked again."""
+        db_name = str(tmp_path / "again.db")
+        schema.ensure_schema(db_name)
+        schema.forget(db_name)
+        with patch("schema.migrate") as migrate:
+            schema.ensure_schema(db_name)
+        migrate.assert_called_once()
+
+
+def insert_actions(conn, actions):
+    for user, task_id, action in actions:
+        conn.execute(
+            "INSERT INTO tasks (user, id, action_at, action) "
+            "VALUES (?, ?, datetime('now'), ?)",
+            (user, task_id, action),
+        )
+    conn.commit()
+
+
+def state(conn):
+    return (
+        conn.execute("SELECT * FROM user_state ORDER BY user").fetchall(),
+        conn.execute("SELECT * FROM task_state ORDER BY user, id").fetchall(),
+    )
+
+
+class TestStateSummary:
+    """Test the state summary maintained by the trigger."""
+
+    ACTIONS = [
+        ("u", "a", "help"),
+        ("u", "a", "found"),
+        ("u", "a", "show"),
+        ("u", "b", "found"),
+        ("u", "b", "show"),
+        ("v", "x", "done"),
+        ("v", "x", "show"),
+        ("u", "a", "veto"),
+        ("u", "c", "show"),
+        ("u", "b", "done"),
+    ]
+
+    def test_trigger_matches_rebuild(self, conn):
+        """The state after each insert equals the state computed from scratch."""
+        schema.migrate(conn)
+        for action in self.ACTIONS:
+            insert_actions(conn, [action])
+            maintained = state(conn)
+            schema.rebuild_state(conn.cursor())
+            assert state(conn) == maintained
+
+    def test_pending_task(self, conn):
+        """Finishing the pending task makes the next unfinished shown task pending."""
+        schema.migrate(conn)
+        insert_actions(conn, self.ACTIONS[:8])
+        row = conn.execute("SELECT vetoes, help_shown, pending_id FROM user_state")
+        assert row.fetchone() == (1, 1, "b")
+        # a task done before it was shown never becomes pending
+        assert conn.execute(
+            "SELECT pending_id FROM user_state WHERE user = 'v'"
+        ).fetchone() == (None,)
+
+    def test_rebuild_command(self, tmp_path):
+        """rebuild-state recomputes the summary of an existing database."""
+        db_name = str(tmp_path / "rebuild.db")
+        connection = sqlite3.connect(db_name)
+        schema.migrate(connection)
+        insert_actions(connection, self.ACTIONS)
+        connection.execute("DELETE FROM user_state")
+        connection.commit()
+        assert schema.main(["schema.py", "rebuild-state", db_name]) == 0
+        assert len(state(connection)[0]) == 2
+        connection.close()
@@ -663,5 +663,192 @@ class TestMultipleSequentialRequests:
         assert resp4.status_code == 200
 
 
+# ============================================================================
+# Threaded Mode Tests
+# ============================================================================
+
+
+POOLED_PORT = 9002
+
+
+@pytest.fixture
+def pooled_server(server_thread):
+    """Start a threaded server with one worker and no waiting room."""
+    from server import PooledHTTPServer
+
+    httpd = PooledHTTPServer(
+        ("localhost", POOLED_PORT),
+        RequestHandler,
+        workers=1,
+        max_pending=0,
+        request_timeout=2,
+        idle_timeout=5,
+    )
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+class TestThreadedMode:
+    """Test the bounded worker pool of the threaded server."""
+
+    def test_serves_requests(self, pooled_server):
+        """Requests are handled one after another by the pool."""
+        for _ in range(3):
+            response = requests.get(
+                f"http://localhost:{POOLED_PORT}/tasks/list",
+                params={"token": TEST_TOKEN_DEFAULT},
+                timeout=5,
+            )
+            assert response.status_code == 200
+        assert pooled_server.stats()["rejected"] == 0
+
+    def test_keep_alive(self, pooled_server):
+        """A session sends all its requests over one connection."""
+        with requests.Session() as session:
+            for _ in range(3):
+                response = session.get(
+                    f"http://localhost:{POOLED_PORT}/tasks/list",
+                    params={"token": TEST_TOKEN_DEFAULT},
+                    timeout=5,
+                )
+                assert response.status_code == 200
+                assert response.raw.version == 11
+                assert response.headers["Content-Type"] == "text/html; charset=utf-8"
+                assert int(response.headers["Content-Length"]) == len(response.content)
+        assert pooled_server.stats()["connections"] == 1
+
+    def test_idle_connections_do_not_block(self, pooled_server):
+        """Kept-alive and new idle connections do not hold the only worker."""
+        import socket
+
+        idle = [socket.create_connection(("localhost", POOLED_PORT))]
+        with requests.Session() as session:
+            for _ in range(2):
+                response = session.get(
+                    f"http://localhost:{POOLED_PORT}/tasks/list",
+                    params={"token": TEST_TOKEN_DEFAULT},
+                    timeout=5,
+                )
+                assert response.status_code == 200
+                # the other client finds the worker free at once
+                start = time.monotonic()
+                response = requests.get(
+                    f"http://localhost:{POOLED_PORT}/tasks/list",
+                    params={"token": TEST_TOKEN_DEFAULT},
+                    timeout=5,
+                )
+                assert response.status_code == 200
+                assert time.monotonic() - start < 1
+        for sock in idle:
+            sock.close()
+        assert pooled_server.stats()["rejected"] == 0
+
+    def test_full_pool_returns_503(self, pooled_server):
+        """A request arriving while all workers are busy is rejected at once."""
+        import socket
+
+        # a request that is never finished keeps the only worker busy
+        idle = [socket.create_connection(("localhost", POOLED_PORT))]
+        idle[0].sendall(b"GET /tasks/list HTTP/1.1\r\n")
+        try:
+            time.sleep(0.2)
+            response = requests.get(
+                f"http://localhost:{POOLED_PORT}/tasks/list",
+                params={"token": TEST_TOKEN_DEFAULT},
+                timeout=1,
+            )
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "1"
+        finally:
+            for sock in idle:
+                sock.close()
+        assert pooled_server.stats()["rejected"] == 1
+
+
+# ============================================================================
+# Asyncio Front End Tests
+# ============================================================================
+
+
+ASYNC_PORT = 9003
+
+
+@pytest.fixture
+def async_server(server_thread):
+    """Start the asyncio server in a thread with an event loop of its own."""
+    import asyncio
+    from aserver import AsyncServer
+
+    httpd = AsyncServer(host="localhost", port=ASYNC_PORT, workers=2, idle_timeout=2)
+    thread = threading.Thread(target=asyncio.run, args=(httpd.serve(),), daemon=True)
+    thread.start()
+    for _ in range(50):
+        try:
+            requests.get(f"http://localhost:{ASYNC_PORT}/", timeout=1)
+            break
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    yield httpd
+    httpd.stop()
+    thread.join(5)
+
+
+class TestAsyncMode:
+    """Test answering requests from the asyncio front end."""
+
+    def test_list_endpoint(self, async_server):
+        """The asyncio server renders the same pages as the threaded one."""
+        response = requests.get(
+            f"http://localhost:{ASYNC_PORT}/tasks/list",
+            params={"token": TEST_TOKEN_DEFAULT},
+            timeout=5,
+        )
+        assert response.status_code == 200
+        soup = BeautifulSoup(response.content, "html.parser")
+        assert soup.find("table") is not None
+
+    def test_invalid_token(self, async_server):
+        """Token errors are reported as by the threaded server."""
+        response = requests.get(
+            f"http://localhost:{ASYNC_PORT}/tasks/list",
+            params={"token": "invalid"},
+            timeout=5,
+        )
+        assert response.status_code == 403
+
+    def test_keep_alive(self, async_server):
+        """A session sends all its requests over one kept-alive connection."""
+        with requests.Session() as session:
+            for _ in range(3):
+                response = session.get(
+                    f"http://localhost:{ASYNC_PORT}/tasks/list",
+                    params={"token": TEST_TOKEN_DEFAULT},
+                    timeout=5,
+                )
+                assert response.status_code == 200
+                assert response.headers.get("Connection") != "close"
+                assert int(response.headers["Content-Length"]) == len(response.content)
+            assert async_server.connections == 1
+
+    def test_idle_connections_do_not_block(self, async_server):
+        """Idle connections do not keep the executor from answering others."""
+        import socket
+
+        idle = [socket.create_connection(("localhost", ASYNC_PORT)) for _ in range(10)]
+        try:
+            response = requests.get(
+                f"http://localhost:{ASYNC_PORT}/tasks/list",
+                params={"token": TEST_TOKEN_DEFAULT},
+                timeout=2,
+            )
+            assert response.status_code == 200
+        finally:
+            for sock in idle:
+                sock.close()
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "-s"])
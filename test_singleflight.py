@@ -0,0 +1,75 @@
+"""
+Pytest-based test module for coalescing concurrent identical work.
+"""
+
+import threading
+import time
+
+import pytest
+
+import singleflight
+
+
+def run_concurrently(count, target):
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(target())) for _ in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+class TestSingleFlight:
+    """Test sharing the result of a running call."""
+
+    def test_concurrent_calls_share_result(self):
+        flight = singleflight.SingleFlight()
+        calls = []
+
+        def work():
+            calls.append(1)
+            time.sleep(0.2)
+            return object()
+
+        results = run_concurrently(5, lambda: flight.do("key", work))
+        assert len(calls) == 1
+        assert len({id(result) for result in results}) == 1
+        assert flight.stats() == {"leaders": 1, "followers": 4, "running": 0}
+
+    def test_sequential_calls_run_again(self):
+        """Nothing is remembered once a call is done."""
+        flight = singleflight.SingleFlight()
+        assert flight.do("key", lambda: 1) == 1
+        assert flight.do("key", lambda: 2) == 2
+
+    def test_different_keys_run_in_parallel(self):
+        flight = singleflight.SingleFlight()
+        assert flight.do("a", lambda: flight.do("b", lambda: "b") + "a") == "ba"
+
+    def test_error_reaches_all_callers(self):
+        flight = singleflight.SingleFlight()
+        started = threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            time.sleep(0.2)
+            raise RuntimeError("boom")
+
+        def call():
+            try:
+                flight.do("key", fail)
+            except RuntimeError as error:
+                errors.append(error)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        run_concurrently(3, call)
+        leader.join()
+        assert len(errors) == 4
+        with pytest.raises(ValueError):
+            flight.do("key", lambda: int("x"))
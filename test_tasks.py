@@ -0,0 +1,142 @@
+"""
+Pytest-based test module for the task functions working on the database.
+"""
+
+import json
+import sqlite3
+import time
+from unittest.mock import patch
+
+import pytest
+
+import db
+import tasks
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """A directory with config.json and tasks.json, used as working directory."""
+    config_data = {
+        "vetoes": 1,
+        "users": {"default_user": {"token": "42", "notify_email": "test@test.org"}},
+    }
+    tasks_data = {
+        "default_user": {
+            "tasks": [
+                {"id": "task-1", "title": "One", "when": "now", "description": "x"},
+                {"id": "task-2", "title": "Two", "when": "now", "description": "y"},
+            ]
+        }
+    }
+    (tmp_path / "config.json").write_text(json.dumps(config_data))
+    (tmp_path / "tasks.json").write_text(json.dumps(tasks_data))
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+    db.close_connections()
+
+
+@pytest.fixture
+def sent(workspace):
+    """Keep the notifications in the outbox instead of delivering them."""
+    with patch("outbox.wake") as wake:
+        yield wake
+
+
+def outbox_rows():
+    with db.connection(tasks.DB_NAME) as conn:
+        return conn.execute("SELECT recipient, subject, status FROM outbox").fetchall()
+
+
+class TestUnitOfWork:
+    """Test running a whole request in one transaction."""
+
+    def test_show_request_round_trips(self, workspace, sent):
+        """The reads of a /tasks/show request are batched in one transaction."""
+        with db.UnitOfWork(tasks.DB_NAME, write=True) as uow:
+            tasks.get_help_status("default_user", uow=uow)
+            tasks.store_help("default_user", {"id": "task-1", "title": "One"}, uow=uow)
+            tasks.show_task("default_user", 0, uow=uow)
+            tasks.get_remaining_vetoes("default_user", uow=uow)
+            tasks.get_remaining_vetoes("default_user", uow=uow)
+            tasks.get_task_status({"id": "task-1"}, user="default_user", uow=uow)
+        # reads: help, action times, status, pending task, vetoes, status after
+        # the writes; writes: help, found, show and two notifications
+        assert uow.round_trips == 11
+        assert (
+            tasks.get_task_status({"id": "task-1"}, user="default_user") == "Angezeigt"
+        )
+
+    def test_notifications_after_commit(self, workspace, sent):
+        """Notifications are written to the outbox and delivered after the commit."""
+        with db.UnitOfWork(tasks.DB_NAME, write=True) as uow:
+            tasks.do_task("default_user", 0, uow=uow)
+            sent.assert_not_called()
+        sent.assert_called_once()
+        assert outbox_rows() == [("test@test.org", "Task done Notification", "pending")]
+
+    def test_rollback_discards_writes_and_notifications(self, workspace, sent):
+        """An error in the request leaves neither rows nor notifications behind."""
+        with pytest.raises(RuntimeError):
+            with db.UnitOfWork(tasks.DB_NAME, write=True) as uow:
+                tasks.veto_task("default_user", 0, uow=uow)
+                raise RuntimeError("abort")
+        sent.assert_not_called()
+        assert outbox_rows() == []
+        assert tasks.get_remaining_vetoes("default_user") == 1
+
+    def test_reads_see_own_writes(self, workspace, sent):
+        """A remembered read is refreshed after a write in the same unit of work."""
+        with db.UnitOfWork(tasks.DB_NAME, write=True) as uow:
+            assert tasks.get_remaining_vetoes("default_user", uow=uow) == 1
+            assert tasks.veto_task("default_user", 0, uow=uow)
+            assert tasks.get_remaining_vetoes("default_user", uow=uow) == 0
+            assert not tasks.veto_task("default_user", 1, uow=uow)
+
+    def test_failed_status_write_is_not_notified(self, workspace, sent):
+        """A status write that fails ends the request without a notification."""
+        with db.connection(tasks.DB_NAME) as conn:
+            conn.execute(
+                "CREATE TRIGGER refuse BEFORE INSERT ON tasks "
+                "BEGIN SELECT RAISE(ABORT, 'refused'); END"
+            )
+        with pytest.raises(sqlite3.IntegrityError):
+            tasks.do_task("default_user", 0)
+        sent.assert_not_called()
+        assert outbox_rows() == []
+
+    def test_repeated_action_is_no_error(self, workspace, sent):
+        """Repeating an action keeps the first row and notifies again."""
+        tasks.do_task("default_user", 0)
+        tasks.do_task("default_user", 0)
+        with db.connection(tasks.DB_NAME) as conn:
+            count = "SELECT COUNT(*) FROM tasks WHERE action = 'done'"
+            assert conn.execute(count).fetchone()[0] == 1
+        assert len(outbox_rows()) == 2
+
+
+class TestShowTask:
+    """Test revealing a task."""
+
+    def test_found_and_show_in_same_second(self, workspace, sent):
+        """The show action wins over found, although both share a timestamp."""
+        start = time.monotonic()
+        task = tasks.show_task("default_user", 0)
+        assert time.monotonic() - start < 1
+        assert task["id"] == "task-1"
+        assert tasks.get_task_status(task, user="default_user") == "Angezeigt"
+        assert tasks.get_pending_task("default_user")["id"] == "task-1"
+
+
+class TestGetTask:
+    """Test reading a single task instead of the whole list."""
+
+    def test_enriches_a_copy(self, workspace, sent):
+        """Only the returned task carries its status, the catalog stays read-only."""
+        tasks.show_task("default_user", 1)
+        task = tasks.get_task("default_user", 1)
+        assert task["id"] == "task-2"
+        assert task["shown_at"] is not None
+        assert "shown_at" not in tasks.get_task("default_user", 0)
+        assert (
+            "shown_at" not in tasks.catalog.catalog.user_tasks("default_user").tasks[1]
+        )
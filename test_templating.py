@@ -0,0 +1,85 @@
+"""
+Pytest-based test module for the template registry.
+"""
+
+import os
+
+import pytest
+
+import templating
+
+
+@pytest.fixture
+def template_dir(tmp_path):
+    """A directory with two valid templates."""
+    (tmp_path / "page.tpl").write_text("<h1>$title</h1>")
+    (tmp_path / "other.tpl").write_text("<p>$text</p>")
+    return tmp_path
+
+
+class TestTemplateRegistry:
+    """Test compiling, caching and reloading templates."""
+
+    def test_compiles_once(self, template_dir):
+        """All templates are compiled at load and served from memory."""
+        registry = templating.TemplateRegistry(str(template_dir))
+        assert registry.load(required=("page.tpl",)) == ["other.tpl", "page.tpl"]
+        assert registry.render("page.tpl", {"title": "Hi"}) == b"<h1>Hi</h1>"
+        registry.render("page.tpl", {"title": "Ho"})
+        assert registry.stats() == {"hits": 2, "reloads": 1}
+
+    def test_missing_template_fails_at_load(self, template_dir):
+        registry = templating.TemplateRegistry(str(template_dir))
+        with pytest.raises(templating.TemplateError, match="gone.tpl: missing"):
+            registry.load(required=("page.tpl", "gone.tpl"))
+
+    def test_malformed_template_fails_at_load(self, template_dir):
+        (template_dir / "broken.tpl").write_text("costs 5$ today")
+        registry = templating.TemplateRegistry(str(template_dir))
+        with pytest.raises(templating.TemplateError, match="broken.tpl"):
+            registry.load()
+
+    def test_changes_ignored_without_reload(self, template_dir):
+        registry = templating.TemplateRegistry(str(template_dir))
+        registry.load()
+        (template_dir / "page.tpl").write_text("<h2>$title</h2>")
+        assert registry.render("page.tpl", {"title": "Hi"}) == b"<h1>Hi</h1>"
+
+    def test_reload_mode_picks_up_changes(self, template_dir):
+        registry = templating.TemplateRegistry(str(template_dir), reload=True)
+        registry.load()
+        path = template_dir / "page.tpl"
+        path.write_text("<h2>$title</h2>")
+        # we make sure the modification time differs on coarse file systems
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        assert registry.render("page.tpl", {"title": "Hi"}) == b"<h2>Hi</h2>"
+        assert registry.stats()["reloads"] == 2
+
+
+class TestMarkdownCache:
+    """Test the cache of rendered markdown."""
+
+    def test_renders_once(self):
+        cache = templating.MarkdownCache()
+        assert cache.render("*hi*") == "<p><em>hi</em></p>\n"
+        assert cache.render("*hi*") == "<p><em>hi</em></p>\n"
+        assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+    def test_list_is_rendered_line_by_line(self):
+        cache = templating.MarkdownCache()
+        assert cache.render(["a", "b"]) == cache.render("a\nb")
+        assert cache.stats()["hits"] == 1
+
+    def test_bounded(self):
+        """The least recently used entry is dropped first."""
+        cache = templating.MarkdownCache(size=2)
+        cache.render("a")
+        cache.render("b")
+        cache.render("a")
+        cache.render("c")
+        assert cache.stats()["size"] == 2
+        cache.render("a")
+        assert cache.stats()["hits"] == 2
+        cache.render("b")
+        assert cache.stats()["misses"] == 4